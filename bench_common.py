@@ -0,0 +1,58 @@
+"""benchmark.py、replay.py 和 compare_versions.py 共用的辅助函数
+
+本模块不加载任何版本的查看器，compare_versions.py 的子进程也可以导入。
+"""
+import importlib.util
+import math
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+WINDOW_SIZE = (1280, 800)
+
+
+def load_viewer(filename):
+    """以 photo_viewer 为模块名加载查看器脚本
+
+    需要在调用脚本的模块级执行：v2.4 解码服务的 spawn 子进程会重新执行主脚本，需要能按同一模块名找到解码函数。
+    """
+    spec = importlib.util.spec_from_file_location('photo_viewer', os.path.join(HERE, filename))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['photo_viewer'] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def use_temp_cache():
+    """查看器的缩略图、目录索引等缓存写到临时目录，每次都从冷缓存开始，也不污染用户目录"""
+    cache_root = tempfile.mkdtemp(prefix='photo_viewer_cache_')
+    os.environ['XDG_CACHE_HOME'] = cache_root
+    os.environ['LOCALAPPDATA'] = cache_root
+    return cache_root
+
+
+def has_display():
+    return sys.platform in ('win32', 'darwin') or bool(os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+
+
+def pump(root, seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        root.update()
+        time.sleep(0.001)
+
+
+def summarize(samples):
+    """把以秒为单位的样本汇总为毫秒统计，分位数取最近秩"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1)] * 1000
+
+    return {'n': len(ordered), 'mean': statistics.fmean(ordered) * 1000, 'p50': percentile(50),
+            'p90': percentile(90), 'p99': percentile(99), 'max': ordered[-1] * 1000}
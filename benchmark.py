@@ -0,0 +1,388 @@
+"""图片查看器性能基准
+
+生成合成图片集（多种格式，1 MP 到 100 MP，灰度/RGB/RGBA/调色板），测量解码耗时、
+适应窗口/放大/平移的渲染耗时；有显示器（或在 xvfb-run 下）时还会启动查看器，测量缓存命中率
+和切换图片的延迟分位数。结果写成 JSON，便于在不同提交之间对比。
+
+用法：
+    python benchmark.py                      # 完整测试
+    python benchmark.py --quick              # 只用 12 MP 以下的图片
+    xvfb-run python benchmark.py -o base.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import PIL
+from PIL import Image
+
+from bench_common import HERE, WINDOW_SIZE, has_display, load_viewer, pump, summarize, use_temp_cache
+
+# 在模块级加载查看器（原因见 load_viewer）
+viewer = load_viewer('v2.4.py')
+
+DEFAULT_SIZES = [1, 4, 12, 24, 50, 100]
+QUICK_SIZES = [1, 4, 12]
+# 格式和模式的组合只在 12 MP 以下生成，大图只用 JPEG
+MIXED_FORMATS = [('jpg', 'L'), ('png', 'RGB'), ('png', 'RGBA'), ('png', 'L'), ('png', 'P'), ('gif', 'P'),
+                 ('webp', 'RGB'), ('webp', 'RGBA'), ('bmp', 'RGB'), ('tiff', 'RGB')]
+
+
+def timed(fn, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples), result
+
+
+def corpus_spec(sizes):
+    specs = [('jpg', 'RGB', mp) for mp in sizes]
+    for mp in [mp for mp in sizes if mp <= 12][:2]:
+        specs.extend((fmt, mode, mp) for fmt, mode in MIXED_FORMATS)
+    return specs
+
+
+def synthetic_image(size, mode):
+    """渐变叠加噪声，压缩率接近真实照片"""
+    horizontal = Image.linear_gradient('L').rotate(90).resize(size, Image.Resampling.BILINEAR)
+    vertical = Image.linear_gradient('L').resize(size, Image.Resampling.BILINEAR)
+    noise = Image.effect_noise(size, 32)
+    img = Image.merge('RGB', (horizontal, vertical, noise))
+    if mode == 'L':
+        return img.convert('L')
+    if mode == 'RGBA':
+        img.putalpha(vertical)
+        return img
+    if mode == 'P':
+        return img.convert('P', palette=Image.Palette.ADAPTIVE, colors=64)
+    return img
+
+
+def build_corpus(directory, sizes):
+    """生成测试图片；目录中已有同样的清单时直接复用"""
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, 'manifest.json')
+    specs = corpus_spec(sizes)
+    try:
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest['specs'] == [list(s) for s in specs] and all(
+                os.path.exists(os.path.join(directory, e['name'])) for e in manifest['files']):
+            return manifest['files']
+    except (OSError, ValueError, KeyError):
+        pass
+    files = []
+    for fmt, mode, mp in specs:
+        width = round(math.sqrt(mp * 1_000_000 * 1.5))
+        height = round(width / 1.5)
+        name = f"{mp:03d}mp_{mode}.{fmt}"
+        print(f"生成 {name} ({width}x{height})")
+        img = synthetic_image((width, height), mode)
+        img.save(os.path.join(directory, name), **({'quality': 90} if fmt in ('jpg', 'webp') else {}))
+        img.close()
+        files.append({'name': name, 'format': fmt, 'mode': mode, 'megapixels': mp, 'size': [width, height],
+                      'bytes': os.path.getsize(os.path.join(directory, name))})
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump({'specs': [list(s) for s in specs], 'files': files}, f, indent=1)
+    return files
+
+
+def bench_decode(directory, files, repeat, service):
+    """整图解码、按窗口尺寸解码和多进程解码服务（含共享内存传输）"""
+    results = {}
+    for entry in files:
+        path = os.path.join(directory, entry['name'])
+        print(f"解码 {entry['name']}")
+        row = {}
+        with open(path, 'rb') as f:
+            data = f.read()
+        row['full'], _ = timed(lambda: viewer.decode_image(data)[0].close(), repeat)
+        row['display'], (img, meta) = timed(lambda: viewer.decode_image(data, WINDOW_SIZE), repeat)
+        row['display_size'] = list(img.size)
+        if service:
+            # 与 load_image_to_cache 一致只传路径，由解码进程自己读盘
+            def via_service():
+                decoded, shm, _ = service.decode(path, WINDOW_SIZE)
+                decoded.close()
+                viewer.DecodeService.release(shm)
+            row['service'], _ = timed(via_service, repeat)
+        img.close()
+        # 渲染按原图测量：放大和平移时查看器显示的就是原图，适应窗口时才会用到金字塔层级
+        full_img = viewer.decode_image(data)[0]
+        row['render'] = bench_render(path, full_img, repeat)
+        full_img.close()
+        results[entry['name']] = row
+    return results
+
+
+class DummyCanvas:
+    """只实现 draw_view 用到的画布方法"""
+
+    def __init__(self):
+        self.image = None
+
+    def delete(self, *args):
+        pass
+
+    def create_image(self, *args, **kwargs):
+        pass
+
+    def create_text(self, *args, **kwargs):
+        pass
+
+
+class DummyRoot:
+    def after(self, ms, func, *args):
+        pass
+
+
+class InlineExecutor:
+    """在调用线程里直接执行，金字塔在首次渲染时同步生成"""
+
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+class RenderStub(viewer.ImageViewer):
+    """只带渲染所需状态的查看器，直接驱动 draw_view：渲染缓存、金字塔层级选择和变换都走查看器自己的代码
+
+    没有 Tk 时不生成 PhotoImage，这部分耗时由 bench_viewer 在显示器下测量。
+    """
+
+    def __init__(self, path, img):
+        self.perf = viewer.PerfStats()
+        self.root = DummyRoot()
+        self.canvas = DummyCanvas()
+        self.image_paths = [path]
+        self.current_index = 0
+        self.cache_lock = threading.RLock()
+        self.image_cache = {path: (img, 0)}
+        self.current_cache_size = 0
+        self.transforms = {}
+        self.render_cache = OrderedDict()
+        self.render_cache_size = 0
+        self.render_cache_limit = 512 * 1024 * 1024
+        self.pyramids = {}
+        self.pyramid_pending = set()
+        self.pyramid_min_side = 256
+        self.preload_executor = InlineExecutor()
+        self.zoom_factor = 1.0
+        self.viewport_x = self.viewport_y = 0
+        self.viewport_width, self.viewport_height = img.size
+
+    def make_photo(self, img):
+        return img
+
+    def high_quality_redraw(self):
+        pass
+
+    def set_view(self, zoom_factor, box, transform=viewer.IDENTITY_TRANSFORM):
+        self.transforms[self.image_paths[0]] = transform
+        self.zoom_factor = zoom_factor
+        self.viewport_x, self.viewport_y = box[0], box[1]
+        self.viewport_width, self.viewport_height = box[2] - box[0], box[3] - box[1]
+
+    def draw(self, img, resample, cached=False):
+        if not cached:
+            self.render_cache.clear()
+            self.render_cache_size = 0
+        self.draw_view(img, resample, self.image_paths[0], *WINDOW_SIZE)
+
+
+def bench_render(path, img, repeat):
+    """用查看器的 draw_view 渲染：适应窗口、放大 2 倍、平移、90° 旋转后的适应窗口，以及渲染缓存命中
+
+    除 *_cached 外每次都先清空渲染缓存；金字塔在第一次缩小渲染时生成，不计入测量。
+    """
+    stub = RenderStub(path, img)
+    full = (0, 0, img.width, img.height)
+    zoom_box = (img.width // 4, img.height // 4, img.width * 3 // 4, img.height * 3 // 4)
+    shift = img.width // 10
+    pan_box = (zoom_box[0] + shift, zoom_box[1], zoom_box[2] + shift, zoom_box[3])
+    views = {'fit': (1.0, full), 'zoom': (2.0, zoom_box), 'pan': (2.0, pan_box)}
+    results = {}
+    for name, resample in (('nearest', Image.Resampling.NEAREST), ('lanczos', Image.Resampling.LANCZOS)):
+        for view, (zoom_factor, box) in views.items():
+            stub.set_view(zoom_factor, box)
+            stub.draw(img, resample)
+            results[f'{view}_{name}'], _ = timed(lambda: stub.draw(img, resample), repeat)
+    stub.set_view(1.0, (0, 0, img.height, img.width), viewer.Transform(False, 90))
+    stub.draw(img, Image.Resampling.LANCZOS)
+    results['rotate90_fit_lanczos'], _ = timed(lambda: stub.draw(img, Image.Resampling.LANCZOS), repeat)
+    stub.set_view(1.0, full)
+    stub.draw(img, Image.Resampling.LANCZOS)
+    results['fit_lanczos_cached'], _ = timed(lambda: stub.draw(img, Image.Resampling.LANCZOS, cached=True), repeat)
+    results['render_hit_rate'] = stub.perf.hit_rate('render')
+    for levels in stub.pyramids.values():
+        for level in levels[1]:
+            level.close()
+    return results
+
+
+def bench_tiled(directory, files, repeat, min_megapixels):
+    """分块后端（超大图片或缓存较小时使用）：切块耗时和分块渲染耗时"""
+    results = {}
+    for entry in files:
+        width, height = entry['size']
+        if entry['format'] != 'jpg' or entry['megapixels'] < min_megapixels:
+            continue
+        path = os.path.join(directory, entry['name'])
+        print(f"分块 {entry['name']}")
+        with tempfile.TemporaryDirectory() as store_root:
+            tiled = viewer.TiledImage(path, (width, height), store_root, 512, 256 * 1024 * 1024)
+            start = time.perf_counter()
+            viewer.prepare_tile_store(path, tiled.store_dir, 512)
+            prepare = time.perf_counter() - start
+            tiled.reload()
+            fit = viewer.ImageViewer.fit_size(width, height, *WINDOW_SIZE)
+            row = {'prepare': prepare * 1000}
+            row['render_fit'], _ = timed(lambda: tiled.render((0, 0, width, height), fit,
+                                                              Image.Resampling.LANCZOS), repeat)
+            box = (width // 2, height // 2, width // 2 + WINDOW_SIZE[0], height // 2 + WINDOW_SIZE[1])
+            row['render_1to1'], _ = timed(lambda: tiled.render(box, WINDOW_SIZE, Image.Resampling.LANCZOS), repeat)
+            tiled.close()
+        results[entry['name']] = row
+    return results
+
+
+def bench_viewer(directory, files, rounds, interval):
+    """启动查看器，按固定间隔切换图片，记录每次切换的延迟和切换时是否命中缓存"""
+    import tkinter as tk
+    root = tk.Tk()
+    root.geometry(f"{WINDOW_SIZE[0]}x{WINDOW_SIZE[1]}")
+    app = viewer.ImageViewer(root)
+    pump(root, 0.5)
+    names = sorted(entry['name'] for entry in files)
+    first = os.path.join(directory, names[0])
+    start = time.perf_counter()
+    app.load_directory_images(directory, first)
+    while len(app.image_paths) < len(names) and time.perf_counter() - start < 30:
+        pump(root, 0.05)
+    open_time = time.perf_counter() - start
+
+    latencies = {'next': [], 'prev': []}
+    hits = misses = 0
+    redraws = {'fast': [], 'high_quality': []}
+    # 从头向后翻 rounds 轮，再从末尾向前翻一轮
+    phases = [(0, 'next')] * rounds + [(len(app.image_paths) - 1, 'prev')]
+    for start_index, direction in phases:
+        app.current_index = start_index
+        app.show_current_image()
+        pump(root, interval)
+        for _ in range(len(app.image_paths) - 1):
+            target = app.current_index + (1 if direction == 'next' else -1)
+            if app.image_paths[target] in app.image_cache:
+                hits += 1
+            else:
+                misses += 1
+            start = time.perf_counter()
+            app.navigate(direction)
+            root.update_idletasks()
+            latencies[direction].append(time.perf_counter() - start)
+            # 重绘耗时：先清空渲染缓存，测量的是实际的裁剪缩放和 PhotoImage 生成
+            for kind, redraw in (('fast', app.fast_redraw), ('high_quality', app.high_quality_redraw)):
+                app.render_cache.clear()
+                app.render_cache_size = 0
+                start = time.perf_counter()
+                redraw()
+                root.update_idletasks()
+                redraws[kind].append(time.perf_counter() - start)
+            pump(root, interval)
+    result = {
+        'open_directory_ms': open_time * 1000,
+        'navigation_next': summarize(latencies['next']),
+        'navigation_prev': summarize(latencies['prev']),
+        'cache_hit_rate': hits / (hits + misses) if hits + misses else None,
+        'redraw_fast': summarize(redraws['fast']),
+        'redraw_high_quality': summarize(redraws['high_quality']),
+    }
+    app.on_close()
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="图片查看器性能基准")
+    parser.add_argument('--corpus', default=os.path.join(tempfile.gettempdir(), 'photo_viewer_corpus'),
+                        help="测试图片目录（已生成时复用）")
+    parser.add_argument('--sizes', type=int, nargs='+', help="图片尺寸（百万像素）")
+    parser.add_argument('--quick', action='store_true', help="只测试 12 MP 以下的图片")
+    parser.add_argument('--repeat', type=int, default=3, help="每项测量的重复次数")
+    parser.add_argument('--rounds', type=int, default=2, help="查看器中向后翻页的轮数")
+    parser.add_argument('--interval', type=float, default=0.1, help="查看器中两次翻页之间的间隔（秒）")
+    parser.add_argument('--tiled-min-mp', type=int, default=50, help="测试分块后端的最小图片尺寸（百万像素）")
+    parser.add_argument('--no-service', action='store_true', help="不测试多进程解码服务")
+    parser.add_argument('--no-viewer', action='store_true', help="不启动查看器")
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help="结果 JSON 文件")
+    args = parser.parse_args()
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else DEFAULT_SIZES)
+    corpus = os.path.join(args.corpus, '_'.join(str(s) for s in sizes))
+    files = build_corpus(corpus, sizes)
+
+    use_temp_cache()
+
+    report = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'window_size': list(WINDOW_SIZE),
+        'corpus': files,
+    }
+    service = None if args.no_service else viewer.DecodeService()
+    try:
+        report['decode'] = bench_decode(corpus, files, args.repeat, service)
+    finally:
+        if service:
+            service.shutdown()
+    report['tiled'] = bench_tiled(corpus, files, args.repeat, args.tiled_min_mp)
+    if args.no_viewer:
+        report['viewer'] = {'skipped': "已通过 --no-viewer 跳过"}
+    elif not has_display():
+        report['viewer'] = {'skipped': "没有显示器，可在 xvfb-run 下运行以测量查看器"}
+    else:
+        report['viewer'] = bench_viewer(corpus, files, args.rounds, args.interval)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1, ensure_ascii=False)
+    print_summary(report)
+    print(f"结果已写入 {args.output}")
+
+
+def print_summary(report):
+    print(f"{'文件':<20}{'整图解码':>10}{'窗口解码':>10}{'解码服务':>10}{'适应窗口':>10}{'放大':>10}")
+    for name, row in report['decode'].items():
+        cells = [row['full'], row['display'], row.get('service'), row['render']['fit_lanczos'],
+                 row['render']['zoom_lanczos']]
+        print(f"{name:<20}" + ''.join(f"{c['p50']:>10.1f}" if c else f"{'-':>10}" for c in cells))
+    viewer_result = report['viewer']
+    if 'skipped' in viewer_result:
+        print(f"查看器：{viewer_result['skipped']}")
+    else:
+        nav = viewer_result['navigation_next']
+        print(f"切换图片 p50 {nav['p50']:.1f} ms, p90 {nav['p90']:.1f} ms, p99 {nav['p99']:.1f} ms, "
+              f"缓存命中率 {viewer_result['cache_hit_rate']:.0%}")
+
+
+if __name__ == '__main__':
+    main()
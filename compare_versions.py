@@ -0,0 +1,311 @@
+"""横向比较各版本查看器（v1.0.py … v2.4.py）的加载与缓存策略
+
+对每个版本在独立子进程中启动真实的 ImageViewer，使用同一组合成图片、同样的缓存预算和同样的
+访问序列（顺序前进、倒退、带随机跳转的浏览）逐张调用 show_current_image，记录：
+  - show_current_image 的返回耗时，以及当前图片真正进入缓存的耗时（后台加载的版本两者不同）
+  - 切换时的缓存命中率
+  - load_image_to_cache / remove_oldest_image 的调用次数和耗时
+  - 进程（含解码子进程）的内存峰值
+每个版本一个子进程，内存峰值互不影响。测试图片与 benchmark.py 共用。需要显示器或 xvfb-run。
+
+用法：
+    python compare_versions.py
+    python compare_versions.py --versions v2.3 v2.4 --cache-mb 200 -o compare.json
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import psutil
+
+from bench_common import HERE, WINDOW_SIZE, has_display, load_viewer, pump, summarize, use_temp_cache
+
+# 子进程通过环境变量指定要测试的版本，在模块级加载（原因见 load_viewer）
+VERSION_ENV = 'PHOTO_VIEWER_VERSION'
+if os.environ.get(VERSION_ENV):
+    viewer = load_viewer(os.environ[VERSION_ENV])
+else:
+    # 主进程用 benchmark.py 生成测试图片；它在导入时以同一模块名加载 v2.4，因此不能在子进程中导入
+    import benchmark
+
+DEFAULT_SIZES = [1, 4, 12]
+
+
+def discover_versions():
+    """仓库中的各版本脚本，按版本号排序"""
+    versions = []
+    for path in glob.glob(os.path.join(HERE, 'v*.py')):
+        match = re.fullmatch(r'v(\d+)\.(\d+)\.py', os.path.basename(path))
+        if match:
+            versions.append(((int(match.group(1)), int(match.group(2))), os.path.basename(path)))
+    return [name for _, name in sorted(versions)]
+
+
+def access_pattern(count, seed):
+    """顺序前进一轮、倒退一轮，再按 7:3 的比例混合相邻切换和随机跳转走 2 * count 步"""
+    pattern = list(range(count)) + list(range(count - 2, -1, -1))
+    rng = random.Random(seed)
+    index = pattern[-1]
+    for _ in range(2 * count):
+        if rng.random() < 0.7:
+            index = min(count - 1, max(0, index + rng.choice((-1, 1))))
+        else:
+            index = rng.randrange(count)
+        pattern.append(index)
+    return pattern
+
+
+class MemorySampler(threading.Thread):
+    """周期性采样本进程及其子进程的常驻内存之和，记录峰值"""
+
+    def __init__(self, interval=0.01):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = 0
+        self.running = True
+
+    def sample(self):
+        total = 0
+        for proc in [self.process] + self.process.children(recursive=True):
+            try:
+                total += proc.memory_info().rss
+            except psutil.Error:
+                pass
+        self.peak = max(self.peak, total)
+        return total
+
+    def run(self):
+        while self.running:
+            self.sample()
+            time.sleep(self.interval)
+
+
+class CallTimer:
+    """包装实例方法，统计调用次数和累计耗时；后台加载线程也会调用，因此加锁"""
+
+    def __init__(self, obj, name):
+        self.method = getattr(obj, name)
+        self.lock = threading.Lock()
+        self.samples = []
+        setattr(obj, name, self)
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.method(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.samples.append(elapsed)
+
+
+def run_worker(args):
+    """在子进程中运行：测量当前版本，把原始样本写入 args.output"""
+    import tkinter as tk
+    use_temp_cache()
+
+    sampler = MemorySampler()
+    sampler.start()
+    root = tk.Tk()
+    root.geometry(f"{WINDOW_SIZE[0]}x{WINDOW_SIZE[1]}")
+    app = viewer.ImageViewer(root)
+    pump(root, 0.5)
+    # 所有版本使用同一缓存预算；v2.4 的文件缓存和渲染缓存按原有比例随之缩放
+    ratio = args.cache_bytes / app.cache_size_limit
+    for attr in ('cache_size_limit', 'file_cache_limit', 'render_cache_limit'):
+        if hasattr(app, attr):
+            setattr(app, attr, int(getattr(app, attr) * ratio))
+    loads = CallTimer(app, 'load_image_to_cache')
+    evictions = CallTimer(app, 'remove_oldest_image')
+    with open(args.pattern, encoding='utf-8') as f:
+        job = json.load(f)
+    app.image_paths = [os.path.join(args.corpus, name) for name in job['names']]
+    baseline_rss = sampler.sample()
+
+    result = {'version': os.environ[VERSION_ENV], 'baseline_rss': baseline_rss}
+    if args.preprocess and hasattr(app, 'preprocess_images'):
+        # v2.2 的预处理实验：整个目录预先缩小转灰度后放入缓存
+        start = time.perf_counter()
+        try:
+            app.preprocess_images()
+            result['preprocess'] = {'seconds': time.perf_counter() - start}
+        except Exception as e:
+            result['preprocess'] = {'seconds': time.perf_counter() - start, 'error': repr(e)}
+
+    show, ready, hits, timeouts = [], [], [], 0
+    started = time.perf_counter()
+    for index in job['pattern']:
+        path = app.image_paths[index]
+        hits.append(path in app.image_cache)
+        app.current_index = index
+        start = time.perf_counter()
+        app.show_current_image()
+        root.update_idletasks()
+        show.append(time.perf_counter() - start)
+        # 先显示占位图、在后台加载原图的版本，等图片真正进入缓存才算就绪
+        deadline = start + args.interval + args.ready_timeout
+        while path not in app.image_cache and time.perf_counter() < deadline:
+            root.update()
+            time.sleep(0.001)
+        if path in app.image_cache:
+            ready.append(time.perf_counter() - start)
+        else:
+            timeouts += 1
+        pump(root, max(0.0, start + args.interval - time.perf_counter()))
+    result.update({
+        'seconds': time.perf_counter() - started,
+        'show': show,
+        'ready': ready,
+        'ready_timeouts': timeouts,
+        'hits': sum(hits),
+        'steps': len(hits),
+        'loads': list(loads.samples),
+        'evictions': len(evictions.samples),
+        'eviction_seconds': sum(evictions.samples),
+        'cached_images': len(app.image_cache),
+    })
+    sampler.running = False
+    result['peak_rss'] = max(sampler.peak, sampler.sample())
+    if hasattr(app, 'on_close'):
+        app.on_close()
+    else:
+        root.destroy()
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(result, f)
+
+
+def run_version(version, args, corpus, pattern_path, cache_bytes, output):
+    env = dict(os.environ, **{VERSION_ENV: version})
+    command = [sys.executable, os.path.abspath(__file__), '--worker', '--corpus', corpus, '--pattern', pattern_path,
+               '--cache-bytes', str(cache_bytes), '--interval', str(args.interval),
+               '--ready-timeout', str(args.ready_timeout), '-o', output]
+    if args.preprocess:
+        command.append('--preprocess')
+    # 各版本会打印调试信息，只在出错时显示
+    completed = subprocess.run(command, env=env, capture_output=True, text=True, timeout=args.timeout)
+    if completed.returncode != 0:
+        print(f"{version} 运行失败（退出码 {completed.returncode}）:\n{completed.stderr[-2000:]}")
+        return None
+    with open(output, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def summarize_version(raw, summarize):
+    loads = raw['loads']
+    result = {
+        'seconds': raw['seconds'],
+        'show': summarize(raw['show']),
+        'ready': summarize(raw['ready']),
+        'ready_timeouts': raw['ready_timeouts'],
+        'hit_rate': raw['hits'] / raw['steps'] if raw['steps'] else None,
+        'load_calls': len(loads),
+        'load_seconds': sum(loads),
+        'load': summarize(loads),
+        'evictions': raw['evictions'],
+        'eviction_seconds': raw['eviction_seconds'],
+        'cached_images': raw['cached_images'],
+        'baseline_rss': raw['baseline_rss'],
+        'peak_rss': raw['peak_rss'],
+    }
+    if 'preprocess' in raw:
+        result['preprocess'] = raw['preprocess']
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="横向比较各版本查看器的加载与缓存策略")
+    parser.add_argument('--versions', nargs='+', help="要比较的版本（如 v1.0 v2.4），默认为全部")
+    parser.add_argument('--corpus', default=os.path.join(tempfile.gettempdir(), 'photo_viewer_corpus'),
+                        help="测试图片目录（与 benchmark.py 共用，已生成时复用）")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="图片尺寸（百万像素）")
+    parser.add_argument('--cache-mb', type=float,
+                        help="所有版本共用的缓存预算（MB），默认为整组图片 RGB 解码后总大小的一半，保证会发生淘汰")
+    parser.add_argument('--interval', type=float, default=0.15, help="两次切换之间的间隔（秒）")
+    parser.add_argument('--ready-timeout', type=float, default=5.0, help="等待当前图片进入缓存的最长时间（秒）")
+    parser.add_argument('--seed', type=int, default=1, help="随机跳转的种子")
+    parser.add_argument('--preprocess', action='store_true', help="在有 preprocess_images 的版本中先运行预处理")
+    parser.add_argument('--timeout', type=float, default=1800, help="单个版本的最长运行时间（秒）")
+    parser.add_argument('-o', '--output', default='compare_results.json', help="结果 JSON 文件")
+    # 子进程参数
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--pattern', help=argparse.SUPPRESS)
+    parser.add_argument('--cache-bytes', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    if not has_display():
+        sys.exit("没有显示器，请在桌面环境或 xvfb-run 下运行")
+    available = discover_versions()
+    versions = available
+    if args.versions:
+        versions = [v if v.endswith('.py') else f"{v}.py" for v in args.versions]
+        missing = [v for v in versions if v not in available]
+        if missing:
+            sys.exit(f"找不到版本: {', '.join(missing)}（可选 {', '.join(available)}）")
+
+    corpus = os.path.join(args.corpus, '_'.join(str(s) for s in args.sizes))
+    files = benchmark.build_corpus(corpus, args.sizes)
+    names = sorted((entry['name'] for entry in files), key=benchmark.viewer.ImageViewer.natural_sort_key)
+    decoded_bytes = sum(entry['size'][0] * entry['size'][1] * 3 for entry in files)
+    cache_bytes = int(args.cache_mb * 1024 * 1024) if args.cache_mb else decoded_bytes // 2
+    pattern = access_pattern(len(names), args.seed)
+
+    work_dir = tempfile.mkdtemp(prefix='photo_viewer_compare_')
+    pattern_path = os.path.join(work_dir, 'pattern.json')
+    with open(pattern_path, 'w', encoding='utf-8') as f:
+        json.dump({'names': names, 'pattern': pattern}, f)
+
+    report = {
+        'revision': benchmark.git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'window_size': list(WINDOW_SIZE),
+        'cache_bytes': cache_bytes,
+        'interval': args.interval,
+        'images': names,
+        'pattern': pattern,
+        'versions': {},
+    }
+    for version in versions:
+        print(f"测试 {version}...")
+        raw = run_version(version, args, corpus, pattern_path, cache_bytes, os.path.join(work_dir, f"{version}.json"))
+        report['versions'][version] = summarize_version(raw, summarize) if raw else None
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1, ensure_ascii=False)
+    print_summary(report)
+    print(f"结果已写入 {args.output}")
+
+
+def print_summary(report):
+    format_memory = benchmark.viewer.ImageViewer.format_memory
+    print(f"{len(report['images'])} 张图片，{len(report['pattern'])} 次切换，"
+          f"缓存预算 {format_memory(report['cache_bytes'])}")
+    print(f"{'版本':<8}{'切换p50':>9}{'切换p90':>9}{'就绪p50':>9}{'就绪p90':>9}{'命中率':>8}{'加载次数':>9}"
+          f"{'加载总计':>10}{'淘汰':>6}{'内存峰值':>11}")
+    for version, row in report['versions'].items():
+        name = version[:-3]
+        if row is None:
+            print(f"{name:<8}运行失败")
+            continue
+        show, ready = row['show'], row['ready'] or {'p50': float('nan'), 'p90': float('nan')}
+        print(f"{name:<8}{show['p50']:>9.1f}{show['p90']:>9.1f}{ready['p50']:>9.1f}{ready['p90']:>9.1f}"
+              f"{row['hit_rate']:>8.0%}{row['load_calls']:>9}{row['load_seconds']:>9.2f}s{row['evictions']:>6}"
+              f"{format_memory(row['peak_rss']):>11}")
+        if row.get('preprocess', {}).get('error'):
+            print(f"{'':<8}preprocess_images 失败: {row['preprocess']['error']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""重放查看器的输入录制，报告帧耗时和主线程卡顿
+
+录制在查看器中通过 文件 > 录制输入 / 保存输入录制 生成。重放时以同样的窗口尺寸和播放设置
+打开目录（默认为录制时的目录），等首张图片加载完毕后按原始时间间隔把事件注入事件队列，
+同时用高频心跳检测主线程卡顿。缓存写到临时目录，每次都从冷缓存开始。需要显示器或 xvfb-run。
+
+用法：
+    python replay.py recording.json
+    python replay.py recording.json /path/to/photos --trace trace.json -o report.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tkinter as tk
+
+import psutil
+
+from bench_common import has_display, load_viewer, summarize, use_temp_cache
+
+# 在模块级加载查看器（原因见 load_viewer）
+viewer = load_viewer('v2.4.py')
+
+HEARTBEAT_MS = 5
+
+
+class Replayer:
+    """按录制的时间线注入事件，记录每个事件的注入延迟、心跳间隔和进程内存"""
+
+    def __init__(self, root, app, recording, speed, stall_ms, settle, trace_path):
+        self.root = root
+        self.app = app
+        self.events = recording['events']
+        self.speed = speed
+        self.stall_ms = stall_ms
+        self.settle = settle
+        self.trace_path = trace_path
+        self.process = psutil.Process()
+        self.origin = 0.0
+        self.next_event = 0
+        self.lags = []
+        self.stalls = []
+        self.last_beat = 0.0
+        self.last_rss_sample = 0.0
+        self.peak_rss = 0
+        self.finished = False
+        self.report = None
+
+    def after(self, ms, func, *args):
+        # 绕过查看器开启跟踪时对 root.after 的包装，心跳不应出现在跟踪里
+        return tk.Misc.after(self.root, ms, func, *args)
+
+    def wait_until_ready(self, timeout=60.0, warmup=1.0):
+        """等目录扫描完成、首张图片进入缓存，再留出 warmup 秒给窗口尺寸动画"""
+        start = time.perf_counter()
+        ready_at = None
+        while time.perf_counter() - start < timeout:
+            self.root.update()
+            app = self.app
+            ready = app.directory_watcher is not None and app.image_paths and \
+                app.image_paths[app.current_index] in app.image_cache
+            if ready and ready_at is None:
+                ready_at = time.perf_counter()
+            if ready_at is not None and time.perf_counter() - ready_at >= warmup:
+                return True
+            time.sleep(0.01)
+        return False
+
+    def start(self):
+        self.root.focus_force()
+        self.app.perf = viewer.PerfStats(window=100_000)
+        if self.trace_path:
+            self.app.trace_var.set(True)
+            self.app.start_trace()
+        self.origin = time.perf_counter()
+        self.last_beat = self.origin
+        self.after(HEARTBEAT_MS, self.heartbeat)
+        self.schedule_next()
+
+    def heartbeat(self):
+        now = time.perf_counter()
+        gap = (now - self.last_beat) * 1000 - HEARTBEAT_MS
+        if gap > self.stall_ms:
+            last = self.events[self.next_event - 1] if self.next_event else None
+            self.stalls.append({'t': round(self.last_beat - self.origin, 4), 'ms': round(gap, 1),
+                                'after_event': self.next_event - 1, 'event': last})
+        self.last_beat = now
+        if now - self.last_rss_sample >= 0.1:
+            self.last_rss_sample = now
+            self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+        if not self.finished:
+            self.after(HEARTBEAT_MS, self.heartbeat)
+
+    def schedule_next(self):
+        if self.next_event >= len(self.events):
+            self.after(int(self.settle * 1000), self.finish)
+            return
+        due = self.origin + self.events[self.next_event]['t'] / self.speed
+        self.after(max(0, int((due - time.perf_counter()) * 1000)), self.dispatch, due)
+
+    def dispatch(self, due):
+        # 延迟反映主线程被占用的时间：真实用户的输入在这段时间里同样只能排队
+        self.lags.append(time.perf_counter() - due)
+        self.inject(self.events[self.next_event])
+        self.next_event += 1
+        self.schedule_next()
+
+    def inject(self, event):
+        kind = event['type']
+        widget = self.app.canvas if event.get('widget') == 'canvas' else self.root
+        if kind in ('KeyPress', 'KeyRelease'):
+            widget.event_generate(f'<{kind}>', keysym=event['keysym'], when='tail')
+        elif kind in ('ButtonPress', 'ButtonRelease'):
+            widget.event_generate(f'<{kind}>', button=event['button'], x=event['x'], y=event['y'], when='tail')
+        elif kind == 'Motion':
+            widget.event_generate('<Motion>', x=event['x'], y=event['y'], state=event['state'], when='tail')
+        elif kind == 'MouseWheel':
+            widget.event_generate('<MouseWheel>', delta=event['delta'], x=event['x'], y=event['y'], when='tail')
+        elif kind == 'Configure':
+            self.root.geometry(f"{event['width']}x{event['height']}")
+
+    def finish(self):
+        self.finished = True
+        perf = self.app.perf
+        if self.trace_path:
+            self.app.stop_trace()
+            self.app.trace_recorder.export(self.trace_path)
+        self.report = {
+            'duration_s': time.perf_counter() - self.origin,
+            'events': len(self.events),
+            'input_lag': summarize(self.lags),
+            'stall_threshold_ms': self.stall_ms,
+            'stall_count': len(self.stalls),
+            'stall_total_ms': round(sum(stall['ms'] for stall in self.stalls), 1),
+            'stalls': sorted(self.stalls, key=lambda stall: -stall['ms']),
+            'stages': {name: perf.percentiles(name) for name in perf.names()},
+            'show_histogram': dict(zip([f"<={bound}" for bound in viewer.PerfStats.BUCKETS] + ['>'],
+                                       perf.histogram('show'))),
+            'hit_rates': {name: perf.hit_rate(name) for name in ('bitmap', 'frame_ring', 'render')},
+            'peak_rss': self.peak_rss,
+        }
+        self.app.on_close()
+
+
+def start_image(directory, name):
+    """录制时的起始图片；目录中没有同名文件时退回按自然顺序的第一张"""
+    path = os.path.join(directory, name)
+    if os.path.isfile(path):
+        return path
+    names = sorted((entry for entry in os.listdir(directory)
+                    if entry.rsplit('.', 1)[-1].lower() in viewer.IMAGE_EXTENSIONS),
+                   key=viewer.ImageViewer.natural_sort_key)
+    if not names:
+        return None
+    print(f"目录中没有 {name}，改为从 {names[0]} 开始，结果可能与录制时不同")
+    return os.path.join(directory, names[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="重放查看器的输入录制")
+    parser.add_argument('recording', help="录制文件（JSON）")
+    parser.add_argument('directory', nargs='?', help="图片目录，默认为录制时的目录")
+    parser.add_argument('--speed', type=float, default=1.0, help="重放速度倍数")
+    parser.add_argument('--stall-ms', type=float, default=50.0, help="主线程超过此时长无响应计为卡顿（毫秒）")
+    parser.add_argument('--settle', type=float, default=1.0, help="最后一个事件之后继续观察的秒数")
+    parser.add_argument('--trace', help="同时导出 Chrome 跟踪文件")
+    parser.add_argument('-o', '--output', default='replay_results.json', help="结果 JSON 文件")
+    args = parser.parse_args()
+
+    if not has_display():
+        sys.exit("没有显示器，请在桌面环境或 xvfb-run 下运行")
+    with open(args.recording, encoding='utf-8') as f:
+        recording = json.load(f)
+    directory = os.path.abspath(args.directory or recording['directory'])
+    initial_path = start_image(directory, recording['start_image'])
+    if initial_path is None:
+        sys.exit(f"目录中没有图片: {directory}")
+
+    use_temp_cache()
+
+    root = tk.Tk()
+    width, height = recording['window_size']
+    root.geometry(f"{width}x{height}")
+    app = viewer.ImageViewer(root)
+    settings = recording.get('settings', {})
+    app.slideshow_fps = settings.get('slideshow_fps', app.slideshow_fps)
+    app.slideshow_policy = settings.get('slideshow_policy', app.slideshow_policy)
+    app.load_directory_images(directory, initial_path)
+
+    replayer = Replayer(root, app, recording, args.speed, args.stall_ms, args.settle, args.trace)
+    if not replayer.wait_until_ready():
+        app.on_close()
+        sys.exit("等待首张图片加载超时")
+    replayer.start()
+    root.mainloop()
+
+    report = dict(replayer.report, recording=os.path.abspath(args.recording), directory=directory,
+                  python=platform.python_version(), platform=platform.platform(), cpu_count=os.cpu_count())
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1, ensure_ascii=False)
+    print_summary(report)
+    print(f"结果已写入 {args.output}")
+
+
+def print_summary(report):
+    print(f"重放 {report['events']} 个事件，用时 {report['duration_s']:.1f} 秒")
+    lag = report['input_lag']
+    if lag:
+        print(f"输入注入延迟 p50 {lag['p50']:.1f} ms, p90 {lag['p90']:.1f} ms, 最大 {lag['max']:.1f} ms")
+    print(f"卡顿（>{report['stall_threshold_ms']:g} ms）{report['stall_count']} 次，共 {report['stall_total_ms']:.0f} ms")
+    for stall in report['stalls'][:5]:
+        event = stall['event']
+        where = f"{event['type']} {event.get('keysym', '')}".strip() if event else "开始前"
+        print(f"  {stall['t']:8.3f}s  {stall['ms']:7.1f} ms  在 {where} 之后")
+    for name in ('show', 'redraw', 'load.decode'):
+        stats = report['stages'].get(name)
+        if stats:
+            print(f"{name:<12} p50 {stats[50]:.1f} ms, p90 {stats[90]:.1f} ms, 最大 {stats['max']:.1f} ms")
+    rates = ", ".join(f"{name} {rate:.0%}" for name, rate in report['hit_rates'].items() if rate is not None)
+    if rates:
+        print(f"命中率 {rates}")
+
+
+if __name__ == '__main__':
+    main()
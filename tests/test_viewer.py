@@ -0,0 +1,290 @@
+"""v2.4.py 中不依赖显示器的部分：解码、后台预热、按需加载原图、目录监视"""
+import importlib.util
+import io
+import os
+import queue
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from collections import OrderedDict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+VIEWER_PATH = os.path.join(os.path.dirname(HERE), 'v2.4.py')
+
+spec = importlib.util.spec_from_file_location('photo_viewer', VIEWER_PATH)
+viewer = importlib.util.module_from_spec(spec)
+sys.modules['photo_viewer'] = viewer
+spec.loader.exec_module(viewer)
+
+
+class DecodeTest(unittest.TestCase):
+    def encode(self, fmt):
+        buffer = io.BytesIO()
+        viewer.Image.new('RGB', (4000, 3000), (90, 120, 150)).save(buffer, fmt)
+        return buffer.getvalue()
+
+    def test_jpeg_limit_applies_to_draft_size(self):
+        img, meta = viewer.decode_image(self.encode('JPEG'), (1000, 750), max_pixels=10_000_000)
+        self.assertEqual(img.size, (1000, 750))
+        self.assertEqual(meta['full_size'], (4000, 3000))
+        self.assertEqual(meta['scale'], 4.0)
+
+    def test_format_without_draft_still_too_large(self):
+        with self.assertRaises(viewer.ImageTooLarge) as caught:
+            viewer.decode_image(self.encode('PNG'), (1000, 750), max_pixels=10_000_000)
+        self.assertEqual(caught.exception.full_size, (4000, 3000))
+
+
+class TileStoreTest(unittest.TestCase):
+    def test_trim_removes_least_recently_used_stores(self):
+        with tempfile.TemporaryDirectory() as root:
+            for i, name in enumerate(['old', 'kept', 'new']):
+                store_dir = os.path.join(root, name)
+                os.makedirs(store_dir)
+                with open(os.path.join(store_dir, 'L0_0_0.png'), 'wb') as f:
+                    f.write(bytes(1000))
+                marker = os.path.join(store_dir, 'meta.json')
+                with open(marker, 'w') as f:
+                    f.write('{}')
+                os.utime(marker, (1000 + i, 1000 + i))
+            viewer.trim_tile_stores(root, 2500, keep={os.path.join(root, 'kept')})
+            self.assertEqual(sorted(os.listdir(root)), ['kept', 'new'])
+
+
+class ThumbnailStoreTest(unittest.TestCase):
+    def test_read_does_not_wait_for_another_writer(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'a.png')
+            img = viewer.Image.new('RGB', (1200, 800), (40, 80, 120))
+            img.save(path)
+            store = viewer.ThumbnailStore(os.path.join(directory, 'cache'))
+            self.assertEqual(store.put(path, img, img.size).size, (256, 171))
+            # 另一个查看器实例持有写锁
+            other = sqlite3.connect(os.path.join(directory, 'cache', 'thumbnails.sqlite'))
+            other.execute('BEGIN IMMEDIATE')
+            try:
+                start = time.monotonic()
+                thumb, full_size = store.get(path)
+                self.assertLess(time.monotonic() - start, 1.0)
+                self.assertEqual(full_size, (1200, 800))
+            finally:
+                other.rollback()
+                other.close()
+            store.flush()
+            self.assertEqual(store.accessed, {})
+            store.close()
+
+
+class TkLikeRoot:
+    """模拟 Tk 的跨线程调用：其它线程中的 after 要等主循环执行完才返回"""
+
+    def __init__(self):
+        self.calls = queue.Queue()
+
+    def after(self, ms, func, *args):
+        done = threading.Event()
+        self.calls.put((func, args, done))
+        done.wait()
+
+    def run_until_finished(self, thread, lock, timeout):
+        """主循环：每轮像 start_cache_warmup 一样取一次 warmup_lock，再处理排队的调用"""
+        deadline = time.monotonic() + timeout
+        while thread.is_alive() and time.monotonic() < deadline:
+            if not lock.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                return
+            lock.release()
+            try:
+                func, args, done = self.calls.get(timeout=0.01)
+            except queue.Empty:
+                continue
+            func(*args)
+            done.set()
+
+
+class WarmupTest(unittest.TestCase):
+    def make_viewer(self, count, index):
+        app = viewer.ImageViewer.__new__(viewer.ImageViewer)
+        app.root = TkLikeRoot()
+        app.warmup_lock = threading.Lock()
+        app.loading_active = True
+        app.loading_dialog = None
+        app.image_paths = [f'/photos/{i}.jpg' for i in range(count)]
+        app.current_index = index
+        app.image_cache = {}
+        app.current_cache_size = 0
+        app.cache_size_limit = 1 << 30
+        app.file_cache_size = 0
+        app.file_cache_limit = 1 << 30
+        app.warmup_attempted = set()
+        app.warmup_center = index
+        app.warmup_radius = 0
+        app.warmup_bytes_only = False
+        return app
+
+    def test_warmup_runs_to_completion_from_worker_thread(self):
+        app = self.make_viewer(5, 2)
+        closed = []
+        app.close_loading_dialog = lambda: closed.append(threading.current_thread())
+        visited = []
+
+        def worker():
+            while True:
+                path = app.next_warmup_path()
+                if path is None:
+                    return
+                visited.append(path)
+
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        app.root.run_until_finished(thread, app.warmup_lock, timeout=5.0)
+        thread.join(timeout=1.0)
+
+        self.assertFalse(thread.is_alive(), "预热线程与主循环互相等待")
+        self.assertEqual(visited, [f'/photos/{i}.jpg' for i in (2, 3, 1, 4, 0)])
+        self.assertFalse(app.loading_active)
+        self.assertEqual(closed, [threading.main_thread()])
+        # 结束后再次索取不会重复关闭对话框
+        self.assertIsNone(app.next_warmup_path())
+        self.assertEqual(len(closed), 1)
+
+
+class Canvas:
+    def __init__(self, width=800, height=600):
+        self.width = width
+        self.height = height
+
+    def winfo_width(self):
+        return self.width
+
+    def winfo_height(self):
+        return self.height
+
+
+class QueuedRoot:
+    """after 只排队，由测试在主线程里执行"""
+
+    def __init__(self):
+        self.calls = queue.Queue()
+
+    def after(self, ms, func, *args):
+        self.calls.put((func, args))
+
+
+class FullResolutionTest(unittest.TestCase):
+    def make_viewer(self, path, thumb, meta, cache_size_limit):
+        app = viewer.ImageViewer.__new__(viewer.ImageViewer)
+        app.root = QueuedRoot()
+        app.canvas = Canvas()
+        app.cache_lock = threading.RLock()
+        app.image_paths = [path]
+        app.current_index = 0
+        app.image_cache = {path: (thumb, app.bitmap_size(thumb))}
+        app.current_cache_size = app.bitmap_size(thumb)
+        app.cache_size_limit = cache_size_limit
+        app.lru_list = {path: True}
+        app.image_meta = {path: meta}
+        app.shared_blocks = {}
+        app.pyramids = {}
+        app.transforms = {}
+        app.full_res_pending = set()
+        app.full_res_rejected = set()
+        app.viewport_x = app.viewport_y = 0
+        app.viewport_width, app.viewport_height = thumb.size
+        app.high_quality_redraw = lambda: None
+        return app
+
+    def test_redecode_at_draft_scale_covering_canvas(self):
+        # 按 400x300 解码（1/8）的图片显示在 800x600 的画布上，1/4 的 draft 就够用，不需要原图
+        path = '/photos/big.jpg'
+        thumb = viewer.Image.new('RGB', (400, 300))
+        app = self.make_viewer(path, thumb, {'scale': 8.0, 'full_size': (3200, 2400)}, 1 << 30)
+        requested = []
+
+        def decode(source, target_size=None, *args, **kwargs):
+            requested.append(target_size)
+            return viewer.Image.new('RGB', (800, 600)), None, {'scale': 4.0}
+
+        app.decode = decode
+        app.request_full_resolution()
+        func, args = app.root.calls.get(timeout=2.0)
+        func(*args)
+
+        self.assertEqual(requested, [(800, 600)])
+        self.assertEqual(app.image_cache[path][0].size, (800, 600))
+        self.assertEqual(app.image_meta[path]['scale'], 4.0)
+        self.assertEqual((app.viewport_width, app.viewport_height), (800, 600))
+        self.assertEqual(app.full_res_pending, set())
+
+    def test_oversized_original_not_decoded_again(self):
+        path = '/photos/huge.jpg'
+        thumb = viewer.Image.new('RGB', (80, 60))
+        app = self.make_viewer(path, thumb, {'scale': 4.0, 'full_size': (320, 240)}, 4 * 320 * 240)
+        app.full_res_pending = {path}
+        app.viewport_width, app.viewport_height = 40, 30
+        decoded = []
+        app.decode = lambda *args, **kwargs: decoded.append(args)
+
+        # 原图超过缓存上限的一半，被丢弃后保留缩略解码
+        app.on_full_resolution_ready(path, viewer.Image.new('RGB', (320, 240)))
+        self.assertIs(app.image_cache[path][0], thumb)
+
+        app.request_full_resolution()
+        self.assertEqual(app.full_res_pending, set())
+        self.assertEqual(decoded, [])
+
+
+class PyramidTest(unittest.TestCase):
+    def test_pyramid_evicts_older_images_to_stay_within_limit(self):
+        app = viewer.ImageViewer.__new__(viewer.ImageViewer)
+        app.root = QueuedRoot()
+        app.perf = viewer.PerfStats()
+        app.cache_lock = threading.RLock()
+        app.pyramids = {}
+        app.pyramid_pending = {'/photos/b.jpg'}
+        app.pyramid_min_side = 256
+        app.shared_blocks = {}
+        older = viewer.Image.new('RGB', (1024, 1024))
+        img = viewer.Image.new('RGB', (2048, 2048))
+        app.image_cache = {'/photos/a.jpg': (older, app.bitmap_size(older)),
+                           '/photos/b.jpg': (img, app.bitmap_size(img))}
+        app.lru_list = OrderedDict([('/photos/a.jpg', True), ('/photos/b.jpg', True)])
+        app.current_cache_size = app.bitmap_size(older) + app.bitmap_size(img)
+        app.cache_size_limit = app.current_cache_size + app.bitmap_size(older) // 2
+
+        app.build_pyramid('/photos/b.jpg', img)
+
+        levels = app.pyramids['/photos/b.jpg'][1]
+        self.assertEqual([level.size for level in levels], [(1024, 1024), (512, 512), (256, 256)])
+        self.assertNotIn('/photos/a.jpg', app.image_cache)
+        self.assertLessEqual(app.current_cache_size, app.cache_size_limit)
+
+
+class PollingWatcherTest(unittest.TestCase):
+    def test_in_place_rewrite_reported_as_modified(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'a.jpg')
+            with open(path, 'wb') as f:
+                f.write(b'first')
+            received = queue.Queue()
+            watcher = viewer.DirectoryWatcher(directory, received.put, poll_interval=0.02, full_scan_every=3)
+            # 直接运行轮询后端，Linux 上 start() 会优先选择 inotify
+            thread = threading.Thread(target=watcher.poll_loop, daemon=True)
+            thread.start()
+            try:
+                time.sleep(0.1)
+                dir_mtime = os.stat(directory).st_mtime_ns
+                with open(path, 'wb') as f:
+                    f.write(b'rewritten in place')
+                self.assertEqual(os.stat(directory).st_mtime_ns, dir_mtime)
+                events = received.get(timeout=2.0)
+            finally:
+                watcher.stop()
+                thread.join(timeout=1.0)
+            self.assertEqual(events, [('modified', path)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,14 +1,1219 @@
-import glob
 import concurrent.futures
+import contextlib
+import ctypes
+import ctypes.util
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import math
+import multiprocessing
 import os
+import pathlib
 import sys
 import re
+import select
+import shutil
+import sqlite3
+import struct
 import threading
+import time
 import tkinter as tk
-from collections import OrderedDict, Counter
+import unicodedata
+from collections import OrderedDict, deque, namedtuple
+from multiprocessing import shared_memory
 from tkinter import filedialog, ttk, messagebox
 import psutil
-from PIL import Image, ImageTk
+from PIL import Image, ImageChops, ImageStat, ImageTk, TiffImagePlugin
+
+# 超大图片由分块后端处理，解压炸弹保护的上限放宽到分块后端支持的尺寸（约 40000×40000），
+# 不整个关闭：PIL 对超过上限 2 倍的图片仍会拒绝打开，解码进程导入本模块时同样生效
+Image.MAX_IMAGE_PIXELS = 1_600_000_000
+
+IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'bmp', 'gif', 'webp', 'tiff'}
+
+EXIF_ORIENTATION = 0x0112
+
+
+class ImageTooLarge(Exception):
+    """图片像素数超过整图解码上限，应改用分块后端"""
+
+    def __init__(self, full_size):
+        super().__init__(full_size)
+        self.full_size = full_size
+
+
+def decode_image(source, target_size=None, max_pixels=None):
+    """解码图片为 RGB；JPEG 在给定目标尺寸时使用 draft 按 DCT 缩放（1/2、1/4、1/8）解码
+
+    source 为文件路径或内存中的文件字节。
+    返回 (图片, 元数据)，元数据包含原始尺寸、缩放倍数、格式、EXIF 方向、是否为动画和边缘主色；
+    实际解码的像素数（JPEG 为 draft 缩小后的尺寸）超过 max_pixels 时抛出 ImageTooLarge。
+    方向只读取文件头，像素保持原样，由显示变换负责转正
+    """
+    with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as img:
+        full_size = img.size
+        if target_size and img.format == 'JPEG':
+            # draft 会选择不小于目标尺寸的最小缩放比例
+            img.draft('RGB', target_size)
+        if max_pixels and img.width * img.height > max_pixels:
+            raise ImageTooLarge(full_size)
+        image_format = img.format
+        orientation = img.getexif().get(EXIF_ORIENTATION, 1)
+        animated = getattr(img, 'is_animated', False)
+        # 分阶段计时随元数据一起返回，解码进程中的耗时也能汇总到主进程的 PerfStats
+        t0 = time.perf_counter()
+        img.load()
+        t1 = time.perf_counter()
+        img = img.convert('RGB')
+        t2 = time.perf_counter()
+        edge_color = dominant_edge_color(img)
+        timings = {'decode': t1 - t0, 'convert': t2 - t1, 'edge': time.perf_counter() - t2}
+        scale = full_size[0] / img.width if img.width else 1.0
+        return img, {'full_size': full_size, 'scale': scale, 'format': image_format, 'orientation': orientation,
+                     'animated': animated, 'edge_color': edge_color, 'timings': timings}
+
+
+def dominant_edge_color(img, step=8):
+    """边缘主色：四条边拼成一行，按 step 量化后用 getcolors 统计，返回主色块内像素的平均颜色"""
+    width, height = img.size
+    strips = [img.crop((0, 0, width, 1)), img.crop((0, height - 1, width, height)),
+              img.crop((0, 0, 1, height)).transpose(Image.Transpose.ROTATE_90),
+              img.crop((width - 1, 0, width, height)).transpose(Image.Transpose.ROTATE_90)]
+    edge = Image.new('RGB', (2 * (width + height), 1))
+    x = 0
+    for strip in strips:
+        edge.paste(strip.convert('RGB'), (x, 0))
+        x += strip.width
+    # 量化让相近的颜色归为一组
+    quantized = edge.point([v // step * step for v in range(256)] * 3)
+    _, bucket = max(quantized.getcolors(edge.width))
+    masks = [band.point([255 if v == c else 0 for v in range(256)]) for band, c in zip(quantized.split(), bucket)]
+    mask = ImageChops.multiply(ImageChops.multiply(masks[0], masks[1]), masks[2])
+    return tuple(round(v) for v in ImageStat.Stat(edge, mask).mean)
+
+
+# 90° 整数倍的旋转（逆时针角度）直接换位像素，不经过重采样
+ORTHOGONAL_ROTATIONS = {90: Image.Transpose.ROTATE_90, 180: Image.Transpose.ROTATE_180,
+                        270: Image.Transpose.ROTATE_270}
+
+
+def rotate_bitmap(img, angle):
+    """逆时针旋转 angle 度并扩展画布；直角旋转用 transpose 精确完成，只有任意角度才做 BICUBIC 重采样"""
+    turns = angle % 360
+    if turns == 0:
+        return img.copy()
+    if turns in ORTHOGONAL_ROTATIONS:
+        return img.transpose(ORTHOGONAL_ROTATIONS[turns])
+    return img.rotate(angle, expand=True, resample=Image.BICUBIC)
+
+
+class Transform(namedtuple('Transform', 'mirror angle')):
+    """非破坏性的图片变换：先水平镜像（mirror），再逆时针旋转 angle 度（画布随之扩展）
+
+    缓存的位图保持原样，渲染时只对视口区域应用变换，导出时才作用于原图。
+    显示坐标指变换后图片上的坐标，视口始终以显示坐标表示。
+    """
+
+    __slots__ = ()
+
+    def flipped_horizontal(self):
+        # 镜像与旋转交换顺序时旋转方向相反
+        return Transform(not self.mirror, -self.angle % 360)
+
+    def flipped_vertical(self):
+        # 垂直翻转 = 水平翻转后再旋转 180°
+        return Transform(not self.mirror, (180 - self.angle) % 360)
+
+    def rotated(self, angle):
+        return Transform(self.mirror, (self.angle + angle) % 360)
+
+    @property
+    def is_identity(self):
+        return not self.mirror and self.angle == 0
+
+    @property
+    def is_orthogonal(self):
+        return self.angle == 0 or self.angle in ORTHOGONAL_ROTATIONS
+
+    def cos_sin(self):
+        exact = {0: (1, 0), 90: (0, 1), 180: (-1, 0), 270: (0, -1)}
+        if self.angle in exact:
+            return exact[self.angle]
+        radians = math.radians(self.angle)
+        return round(math.cos(radians), 15), round(math.sin(radians), 15)
+
+    def output_size(self, size):
+        """变换后的图片尺寸"""
+        width, height = size
+        cos, sin = (abs(v) for v in self.cos_sin())
+        if self.is_orthogonal:
+            return (height, width) if sin else (width, height)
+        # 与 Image.rotate(expand=True) 的画布尺寸一致
+        half_width = (cos * width + sin * height) / 2
+        half_height = (sin * width + cos * height) / 2
+        return (math.ceil(width / 2 + half_width) - math.floor(width / 2 - half_width),
+                math.ceil(height / 2 + half_height) - math.floor(height / 2 - half_height))
+
+    def affine(self, size, box, output_size):
+        """把显示坐标中的 box 渲染为 output_size 时，输出像素到原图坐标的仿射系数（Image.AFFINE 的 data）"""
+        width, height = size
+        view_width, view_height = self.output_size(size)
+        cos, sin = self.cos_sin()
+        m = -1 if self.mirror else 1
+        kx = (box[2] - box[0]) / output_size[0]
+        ky = (box[3] - box[1]) / output_size[1]
+        ox = box[0] - view_width / 2
+        oy = box[1] - view_height / 2
+        return (m * cos * kx, -m * sin * ky, width / 2 + m * (cos * ox - sin * oy),
+                sin * kx, cos * ky, height / 2 + sin * ox + cos * oy)
+
+    def source_box(self, size, box):
+        """显示坐标中的 box 在原图上的外接矩形，裁剪到图片范围内"""
+        a, b, c, d, e, f = self.affine(size, box, (1, 1))
+        xs = [a * u + b * v + c for u in (0, 1) for v in (0, 1)]
+        ys = [d * u + e * v + f for u in (0, 1) for v in (0, 1)]
+        return max(0, min(xs)), max(0, min(ys)), min(size[0], max(xs)), min(size[1], max(ys))
+
+    def apply(self, img):
+        """把变换作用到整张图片（导出原图或已取出的视口区域）"""
+        if self.mirror:
+            img = img.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+            if self.angle == 0:
+                return img
+        return rotate_bitmap(img, self.angle)
+
+
+IDENTITY_TRANSFORM = Transform(False, 0)
+
+# EXIF 方向标签取值对应的显示变换（1 为正常方向）
+ORIENTATION_TRANSFORMS = {2: Transform(True, 0), 3: Transform(False, 180), 4: Transform(True, 180),
+                          5: Transform(True, 90), 6: Transform(False, 270), 7: Transform(True, 270),
+                          8: Transform(False, 90)}
+
+# Image.transform 只支持最近邻、双线性和双三次，其它滤镜退回双三次
+AFFINE_RESAMPLE = {Image.Resampling.NEAREST: Image.Resampling.NEAREST,
+                   Image.Resampling.BILINEAR: Image.Resampling.BILINEAR}
+
+
+def decode_to_shared_memory(source, target_size=None, max_pixels=None, band_rows=256):
+    """在解码进程中运行：把像素写入共享内存块，只把块名返回给主进程
+
+    按 band_rows 行一段转换为 RGBX 写入，工作进程除解码结果外只多占一段的内存，不会有整图大小的中间副本。
+    """
+    img, meta = decode_image(source, target_size, max_pixels)
+    width, height = img.size
+    # RGBX 每像素 4 字节，主进程可以用 frombuffer 直接映射，不再复制
+    stride = width * 4
+    shm = shared_memory.SharedMemory(create=True, size=max(1, stride * height))
+    try:
+        for top in range(0, height, band_rows):
+            bottom = min(height, top + band_rows)
+            shm.buf[top * stride:bottom * stride] = img.crop((0, top, width, bottom)).tobytes('raw', 'RGBX')
+        return shm.name, img.size, meta
+    finally:
+        img.close()
+        shm.close()
+
+
+class DecodeService:
+    """常驻的多进程解码服务，解码结果写入共享内存，主进程直接映射，不经过管道复制像素"""
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or os.cpu_count() or 4
+        # spawn 避免 fork 带有 Tk 状态的主进程
+        context = multiprocessing.get_context('spawn')
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+        # 启动时就拉起全部工作进程，第一次后台解码不必等待 spawn
+        for _ in range(self.max_workers):
+            self.executor.submit(os.getpid)
+
+    def decode(self, source, target_size=None, max_pixels=None):
+        """阻塞等待解码结果，返回 (图片, 共享内存块, 元数据)"""
+        future = self.executor.submit(decode_to_shared_memory, source, target_size, max_pixels)
+        name, size, meta = future.result()
+        shm = shared_memory.SharedMemory(name=name)
+        img = Image.frombuffer('RGBX', size, shm.buf, 'raw', 'RGBX', 0, 1)
+        return img, shm, meta
+
+    @staticmethod
+    def release(shm):
+        try:
+            shm.close()
+        except BufferError:
+            pass  # 仍有图片引用该内存，交给垃圾回收
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def native_tile_layout(img):
+    """未压缩的分块 TIFF 可以直接按块读取原文件，返回分块布局；其它格式返回 None"""
+    if img.format != 'TIFF' or getattr(img, 'use_load_libtiff', True):
+        return None
+    tags = img.tag_v2
+    if TiffImagePlugin.TILEOFFSETS not in tags or tags.get(TiffImagePlugin.PLANAR_CONFIGURATION, 1) != 1:
+        return None
+    bits = tags.get(TiffImagePlugin.BITSPERSAMPLE, (8,))
+    bits = sum(bits) if isinstance(bits, tuple) else bits
+    if bits % 8:
+        return None
+    tile_width = tags[TiffImagePlugin.TILEWIDTH]
+    tile_height = tags[TiffImagePlugin.TILELENGTH]
+    tiles = {}
+    for tile in img.tile:
+        x0, y0, x1, y1 = tile[1]
+        rawmode, stride = tile[3][0], int(tile[3][1]) or (x1 - x0) * bits // 8
+        tiles[(x0 // tile_width, y0 // tile_height)] = ((x1 - x0, y1 - y0), tile[2], rawmode, stride)
+    return {'mode': img.mode, 'tile_size': (tile_width, tile_height), 'tiles': tiles}
+
+
+def read_native_tile(f, layout, tx, ty):
+    (width, height), offset, rawmode, stride = layout['tiles'][(tx, ty)]
+    f.seek(offset)
+    data = f.read(stride * height)
+    tile = Image.frombytes(layout['mode'], (width, height), data, 'raw', rawmode, stride)
+    return tile if tile.mode == 'RGB' else tile.convert('RGB')
+
+
+def prepare_tile_store(path, store_dir, tile_size):
+    """在解码进程中运行：把超大图片切成多级分块写入磁盘
+
+    原生分块 TIFF 的第 0 级直接读原文件，只生成缩小的层级；其它格式整图解码一次后切块。
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    with Image.open(path) as img:
+        width, height = img.size
+        layout = native_tile_layout(img)
+        if layout is None:
+            level = img.convert('RGB')
+    levels = []
+    if layout:
+        # 逐块读取并缩小一半拼成第 1 级，内存只需要 1/4 原图
+        tile_width, tile_height = layout['tile_size']
+        level = Image.new('RGB', ((width + 1) // 2, (height + 1) // 2))
+        with open(path, 'rb') as f:
+            for tx, ty in layout['tiles']:
+                tile = read_native_tile(f, layout, tx, ty)
+                level.paste(tile.reduce(2), (tx * tile_width // 2, ty * tile_height // 2))
+                tile.close()
+        levels.append([width, height, tile_width, tile_height])
+    while True:
+        k = len(levels)
+        for ty in range(math.ceil(level.height / tile_size)):
+            for tx in range(math.ceil(level.width / tile_size)):
+                box = (tx * tile_size, ty * tile_size,
+                       min(level.width, (tx + 1) * tile_size), min(level.height, (ty + 1) * tile_size))
+                level.crop(box).save(os.path.join(store_dir, f"L{k}_{tx}_{ty}.png"), compress_level=1)
+        levels.append([level.width, level.height, tile_size, tile_size])
+        if max(level.size) <= tile_size:
+            break
+        next_level = level.reduce(2)
+        level.close()
+        level = next_level
+    # 元数据最后写入，作为分块已生成完整的标记
+    with open(os.path.join(store_dir, 'meta.json'), 'w') as f:
+        json.dump({'size': [width, height], 'levels': levels, 'native': layout is not None}, f)
+
+
+def trim_tile_stores(store_root, max_bytes, keep=()):
+    """分块目录超出容量时按最近使用时间（meta.json 的修改时间）整张图片淘汰，直到降到上限的 90%；keep 中的目录不删除"""
+    try:
+        names = os.listdir(store_root)
+    except OSError:
+        return
+    stores = []
+    total = 0
+    for name in names:
+        store_dir = os.path.join(store_root, name)
+        try:
+            with os.scandir(store_dir) as entries:
+                nbytes = sum(entry.stat().st_size for entry in entries if entry.is_file())
+            marker = os.path.join(store_dir, 'meta.json')
+            used = os.stat(marker if os.path.exists(marker) else store_dir).st_mtime
+        except OSError:
+            continue
+        stores.append((used, store_dir, nbytes))
+        total += nbytes
+    if total <= max_bytes:
+        return
+    keep = set(keep)
+    for _, store_dir, nbytes in sorted(stores):
+        if total <= max_bytes * 0.9:
+            break
+        if store_dir in keep:
+            continue
+        shutil.rmtree(store_dir, ignore_errors=True)
+        total -= nbytes
+
+
+class TiledImage:
+    """超大图片的分块后端：只解码与视口相交的分块，每个分块在内存中独立按 LRU 淘汰"""
+
+    mode = 'RGB'
+
+    def __init__(self, path, full_size, store_root, tile_size=512, budget=256 * 1024 * 1024):
+        # budget 是分块在内存中的上限；缓存只按 tile_bytes 记账，随分块加载增长
+        self.path = path
+        self.size = full_size
+        self.tile_size = tile_size
+        self.budget = budget
+        self.tiles = OrderedDict()
+        self.tile_bytes = 0
+        st = os.stat(path)
+        key = hashlib.blake2b(f"{path}|{st.st_size}|{st.st_mtime_ns}".encode(), digest_size=16).hexdigest()
+        self.store_dir = os.path.join(store_root, key)
+        with Image.open(path) as img:
+            self.layout = native_tile_layout(img)
+        self.native_file = open(path, 'rb') if self.layout else None
+        self.levels = None
+        self.reload()
+
+    @property
+    def width(self):
+        return self.size[0]
+
+    @property
+    def height(self):
+        return self.size[1]
+
+    def getbands(self):
+        return ('R', 'G', 'B')
+
+    @property
+    def ready(self):
+        return self.levels is not None
+
+    def reload(self):
+        try:
+            marker = os.path.join(self.store_dir, 'meta.json')
+            with open(marker) as f:
+                self.levels = json.load(f)['levels']
+            # 标记为最近使用，分块目录按此淘汰
+            os.utime(marker)
+        except (OSError, ValueError, KeyError):
+            self.levels = None
+
+    def get_tile(self, level, tx, ty):
+        key = (level, tx, ty)
+        tile = self.tiles.get(key)
+        if tile is not None:
+            self.tiles.move_to_end(key)
+            return tile
+        if level == 0 and self.layout:
+            tile = read_native_tile(self.native_file, self.layout, tx, ty)
+        else:
+            with Image.open(os.path.join(self.store_dir, f"L{level}_{tx}_{ty}.png")) as f:
+                tile = f.convert('RGB')
+        self.tiles[key] = tile
+        self.tile_bytes += tile.width * tile.height * 3
+        while self.tile_bytes > self.budget and len(self.tiles) > 1:
+            _, old = self.tiles.popitem(last=False)
+            self.tile_bytes -= old.width * old.height * 3
+            old.close()
+        return tile
+
+    def render(self, box, output_size, resample):
+        """把原图坐标中的 box 渲染为 output_size，只读取选中层级里与 box 相交的分块"""
+        if not self.ready:
+            return None
+        source_per_output = min((box[2] - box[0]) / output_size[0], (box[3] - box[1]) / output_size[1])
+        k = 0
+        while k + 1 < len(self.levels) and self.width / self.levels[k + 1][0] <= source_per_output:
+            k += 1
+        level_width, level_height, tile_width, tile_height = self.levels[k]
+        sx = level_width / self.width
+        sy = level_height / self.height
+        level_box = (box[0] * sx, box[1] * sy, min(level_width, box[2] * sx), min(level_height, box[3] * sy))
+        tx0, ty0 = int(level_box[0] // tile_width), int(level_box[1] // tile_height)
+        tx1, ty1 = math.ceil(level_box[2] / tile_width), math.ceil(level_box[3] / tile_height)
+        ox, oy = tx0 * tile_width, ty0 * tile_height
+        # 拼接区域不超出图片边界，避免边缘重采样混入空白
+        region = Image.new('RGB', (min(tx1 * tile_width, level_width) - ox, min(ty1 * tile_height, level_height) - oy))
+        for ty in range(ty0, ty1):
+            for tx in range(tx0, tx1):
+                region.paste(self.get_tile(k, tx, ty), (tx * tile_width - ox, ty * tile_height - oy))
+        return region.resize(output_size, resample,
+                             box=(level_box[0] - ox, level_box[1] - oy, level_box[2] - ox, level_box[3] - oy))
+
+    def overview(self):
+        """最小层级（单个分块），用于缩略图和边缘颜色分析"""
+        if not self.ready:
+            return None
+        return self.get_tile(len(self.levels) - 1, 0, 0)
+
+    def close(self):
+        for tile in self.tiles.values():
+            tile.close()
+        self.tiles.clear()
+        self.tile_bytes = 0
+        if self.native_file:
+            self.native_file.close()
+
+
+class AnimationDecoder:
+    """动画 GIF/WebP 的后台解码：按播放顺序逐帧合成，缩放到显示尺寸后放入有限的帧缓存
+
+    PIL 顺序 seek 时已处理好帧的处置方式和叠加，每帧只合成一次。全部帧放得下时只解码一遍，
+    否则只保留播放位置之后 capacity 帧，取走的帧在下一轮循环时重新解码。
+    """
+
+    def __init__(self, path, display_size, transform, budget):
+        self.path = path
+        self.display_size = display_size
+        self.transform = transform
+        self.budget = budget
+        self.frames = {}
+        self.condition = threading.Condition()
+        self.position = 0
+        self.frame_count = None
+        self.capacity = 2
+        self.stopped = False
+        self.error = None
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        try:
+            with Image.open(self.path) as img:
+                frame_count = getattr(img, 'n_frames', 1)
+                view_width, view_height = self.transform.output_size(img.size)
+                scale = min(self.display_size[0] / view_width, self.display_size[1] / view_height)
+                size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+                capacity = max(2, min(frame_count, self.budget // (size[0] * size[1] * 4)))
+                with self.condition:
+                    self.frame_count = frame_count
+                    self.capacity = capacity
+                index = 0
+                while True:
+                    with self.condition:
+                        # 只解码播放位置之后 capacity 帧以内的部分
+                        while not self.stopped and ((index - self.position) % frame_count >= capacity
+                                                    or index in self.frames):
+                            if capacity == frame_count and len(self.frames) == frame_count:
+                                return  # 全部帧都已缓存
+                            self.condition.wait()
+                        if self.stopped:
+                            return
+                    img.seek(index)
+                    duration = img.info.get('duration') or 100
+                    frame = img.convert('RGBA').resize(size, Image.Resampling.BILINEAR)
+                    frame = self.transform.apply(frame)
+                    with self.condition:
+                        # 浏览器会把过短的帧间隔当作 100ms，这里保持一致
+                        self.frames[index] = (frame, duration if duration >= 20 else 100)
+                        self.condition.notify_all()
+                    index = (index + 1) % frame_count
+        except (OSError, ValueError, EOFError) as e:
+            with self.condition:
+                self.error = e
+                self.condition.notify_all()
+
+    def take(self, index):
+        """返回 (帧, 持续毫秒)；尚未解码好时返回 None。帧缓存放不下全部帧时取走后即释放"""
+        with self.condition:
+            entry = self.frames.get(index)
+            if entry is None:
+                return None
+            if self.capacity < self.frame_count:
+                del self.frames[index]
+            self.position = (index + 1) % self.frame_count
+            self.condition.notify_all()
+            return entry
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.frames.clear()
+            self.condition.notify_all()
+
+
+class DirectoryWatcher:
+    """监视目录中图片文件的增删改名：Linux 上使用 inotify，其它平台退回定期轮询
+
+    回调在后台线程中调用，参数为事件列表：('added', 路径)、('removed', 路径)、('modified', 路径)、
+    ('moved', 旧路径, 新路径)。
+    """
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_DELETE = 0x00000200
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, directory, callback, poll_interval=2.0, full_scan_every=5):
+        self.directory = directory
+        self.callback = callback
+        self.poll_interval = poll_interval
+        self.full_scan_every = full_scan_every
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        try:
+            fd = self.open_inotify()
+            target = self.inotify_loop
+            args = (fd,)
+        except (OSError, AttributeError) as e:
+            print(f"inotify 不可用，改为轮询目录: {e}")
+            target = self.poll_loop
+            args = ()
+        self.thread = threading.Thread(target=target, args=args, daemon=True, name='directory-watcher')
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def is_image(self, name):
+        return os.path.splitext(name)[1][1:].lower() in IMAGE_EXTENSIONS
+
+    def open_inotify(self):
+        if not sys.platform.startswith('linux'):
+            raise OSError('not linux')
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_DELETE
+        if libc.inotify_add_watch(fd, os.fsencode(self.directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, 'inotify_add_watch failed')
+        return fd
+
+    def inotify_loop(self, fd):
+        # MOVED_FROM 可能在下一次 read 才等到配对的 MOVED_TO，保留一轮再当作删除
+        pending_moves = {}
+        try:
+            while not self.stop_event.is_set():
+                readable, _, _ = select.select([fd], [], [], 0.5)
+                events = []
+                carried = pending_moves
+                pending_moves = {}
+                if readable:
+                    data = os.read(fd, 64 * 1024)
+                    offset = 0
+                    while offset < len(data):
+                        _, mask, cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+                        offset += self.EVENT_HEADER.size
+                        name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                        offset += length
+                        if not self.is_image(name):
+                            continue
+                        path = os.path.join(self.directory, name)
+                        if mask & self.IN_MOVED_FROM:
+                            pending_moves[cookie] = path
+                        elif mask & self.IN_MOVED_TO:
+                            old = pending_moves.pop(cookie, None) or carried.pop(cookie, None)
+                            events.append(('moved', old, path) if old else ('added', path))
+                        elif mask & self.IN_DELETE:
+                            events.append(('removed', path))
+                        elif mask & self.IN_CLOSE_WRITE:
+                            events.append(('modified', path))
+                events.extend(('removed', path) for path in carried.values())
+                if events:
+                    self.callback(events)
+        finally:
+            os.close(fd)
+
+    def snapshot(self):
+        files = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if self.is_image(entry.name) and entry.is_file():
+                    st = entry.stat()
+                    files[entry.name] = (st.st_size, st.st_mtime_ns)
+        return files
+
+    def poll_loop(self):
+        try:
+            dir_mtime = os.stat(self.directory).st_mtime_ns
+            files = self.snapshot()
+        except OSError as e:
+            print(f"无法监视目录 {self.directory}: {e}")
+            return
+        polls = 0
+        while not self.stop_event.wait(self.poll_interval):
+            try:
+                # 目录修改时间不变说明没有增删改名，可以跳过逐个 stat；但原地改写文件不改变目录修改时间，
+                # 所以每 full_scan_every 次轮询仍完整比较一次各文件的大小和修改时间
+                new_mtime = os.stat(self.directory).st_mtime_ns
+                polls += 1
+                if new_mtime == dir_mtime and polls < self.full_scan_every:
+                    continue
+                dir_mtime = new_mtime
+                polls = 0
+                new_files = self.snapshot()
+            except OSError:
+                continue
+            events = [('removed', os.path.join(self.directory, name)) for name in files if name not in new_files]
+            for name, signature in new_files.items():
+                if name not in files:
+                    events.append(('added', os.path.join(self.directory, name)))
+                elif files[name] != signature:
+                    events.append(('modified', os.path.join(self.directory, name)))
+            files = new_files
+            if events:
+                self.callback(events)
+
+
+class PerfStats:
+    """各阶段耗时的滚动统计：每个阶段只保留最近 window 个样本，用于分位数和直方图；可跨线程记录
+
+    trace 为 TraceRecorder 时，各阶段同时写成跟踪事件；默认为 None，只多一次属性判断。
+    """
+
+    # 直方图桶的上界（毫秒），最后一桶收集更慢的样本
+    BUCKETS = (1, 2, 4, 8, 16, 33, 66, 133)
+
+    def __init__(self, window=240):
+        self.window = window
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.counters = {}
+        self.trace = None
+
+    def record(self, name, seconds):
+        with self.lock:
+            samples = self.samples.get(name)
+            if samples is None:
+                samples = self.samples[name] = deque(maxlen=self.window)
+            samples.append(seconds * 1000)
+
+    def span(self, name, start, end, **args):
+        """记录一段 perf_counter 时间区间；args 只写入跟踪事件，类别取名称中第一个点之前的部分"""
+        self.record(name, end - start)
+        trace = self.trace
+        if trace is not None:
+            trace.complete(name, name.split('.')[0], start, end, args)
+
+    @contextlib.contextmanager
+    def stage(self, name, **args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.span(name, start, time.perf_counter(), **args)
+
+    def mark(self, name, **args):
+        """记录瞬时事件（按键、淘汰等），未开启跟踪时不做任何事"""
+        trace = self.trace
+        if trace is not None:
+            trace.instant(name, name.split('.')[0], args)
+
+    def sample(self, name, **values):
+        """记录计数器事件（缓存占用等），未开启跟踪时不做任何事"""
+        trace = self.trace
+        if trace is not None:
+            trace.counter(name, values)
+
+    def count(self, name, hit):
+        """记录一次缓存查找，hit 为是否命中"""
+        with self.lock:
+            counter = self.counters.get(name)
+            if counter is None:
+                counter = self.counters[name] = deque(maxlen=self.window)
+            counter.append(bool(hit))
+
+    def percentiles(self, name, quantiles=(50, 90, 99)):
+        """返回 {分位: 毫秒}，另含 'max' 和 'n'；没有样本时返回 None。分位数取最近秩，与 benchmark.py 一致"""
+        with self.lock:
+            values = sorted(self.samples.get(name, ()))
+        if not values:
+            return None
+        result = {q: values[max(0, math.ceil(q / 100 * len(values)) - 1)] for q in quantiles}
+        result['max'] = values[-1]
+        result['n'] = len(values)
+        return result
+
+    def histogram(self, name):
+        """按 BUCKETS 统计最近样本的分布，返回各桶计数（比最后一个上界更慢的计入末尾一桶）"""
+        with self.lock:
+            values = list(self.samples.get(name, ()))
+        counts = [0] * (len(self.BUCKETS) + 1)
+        for value in values:
+            counts[next((i for i, bound in enumerate(self.BUCKETS) if value <= bound), len(self.BUCKETS))] += 1
+        return counts
+
+    def hit_rate(self, name):
+        with self.lock:
+            counter = self.counters.get(name)
+            if not counter:
+                return None
+            return sum(counter) / len(counter)
+
+    def names(self):
+        with self.lock:
+            return sorted(self.samples)
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+            self.counters.clear()
+
+
+class TraceRecorder:
+    """按 Chrome 跟踪事件格式记录时间线，导出的 JSON 可在 Perfetto 或 chrome://tracing 中打开
+
+    时间戳为相对开始记录时刻的微秒；线程名在该线程第一次记录时取得。事件数超过 max_events 时丢弃最早的事件。
+    """
+
+    def __init__(self, max_events=200_000):
+        self.pid = os.getpid()
+        self.origin = time.perf_counter()
+        self.events = deque(maxlen=max_events)
+        self.threads = {}
+        self.lock = threading.Lock()
+
+    def timestamp(self, t):
+        return round((t - self.origin) * 1e6, 1)
+
+    def add(self, event):
+        tid = threading.get_ident()
+        event['pid'] = self.pid
+        event['tid'] = tid
+        with self.lock:
+            if tid not in self.threads:
+                self.threads[tid] = threading.current_thread().name
+            self.events.append(event)
+
+    def complete(self, name, category, start, end, args=None):
+        event = {'name': name, 'cat': category, 'ph': 'X', 'ts': self.timestamp(start),
+                 'dur': round((end - start) * 1e6, 1)}
+        if args:
+            event['args'] = args
+        self.add(event)
+
+    def instant(self, name, category, args=None):
+        event = {'name': name, 'cat': category, 'ph': 'i', 's': 't', 'ts': self.timestamp(time.perf_counter())}
+        if args:
+            event['args'] = args
+        self.add(event)
+
+    def counter(self, name, values):
+        self.add({'name': name, 'ph': 'C', 'ts': self.timestamp(time.perf_counter()), 'args': values})
+
+    def export(self, path):
+        with self.lock:
+            events = list(self.events)
+            threads = dict(self.threads)
+        metadata = [{'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'tid': 0, 'args': {'name': '图片查看器'}}]
+        metadata += [{'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': name}}
+                     for tid, name in threads.items()]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+
+
+def event_kind(event):
+    """事件类型名（'KeyPress' 等）；新版本 Python 中 str(event.type) 得到的是数字编号"""
+    return event.type.name if isinstance(event.type, tk.EventType) else str(event.type)
+
+
+class InputRecorder:
+    """录制输入事件流（按键、鼠标、滚轮、窗口尺寸），时间为相对开始录制的秒数
+
+    保存的 JSON 附带起始图片、窗口尺寸和播放设置，由 replay.py 在另一台机器上针对同一目录重放。
+    """
+
+    # 录制的事件；绑定在插到 bindtags 最前面的 'record' 标签上
+    EVENTS = ('<KeyPress>', '<KeyRelease>', '<ButtonPress>', '<ButtonRelease>', '<B1-Motion>', '<MouseWheel>',
+              '<Configure>')
+
+    def __init__(self, directory, start_image, window_size, settings):
+        self.origin = time.perf_counter()
+        self.header = {'version': 1, 'directory': directory, 'start_image': start_image,
+                       'window_size': list(window_size), 'settings': settings, 'platform': sys.platform}
+        self.events = []
+        self.window_size = tuple(window_size)
+
+    def record(self, event, widget):
+        kind = event_kind(event)
+        if kind == 'Configure':
+            if (event.width, event.height) == self.window_size:
+                return
+            self.window_size = (event.width, event.height)
+        entry = {'t': round(time.perf_counter() - self.origin, 4), 'type': kind, 'widget': widget}
+        if kind in ('KeyPress', 'KeyRelease'):
+            entry['keysym'] = event.keysym
+        elif kind == 'Configure':
+            entry['width'], entry['height'] = event.width, event.height
+        else:
+            entry['x'], entry['y'] = event.x, event.y
+            if kind in ('ButtonPress', 'ButtonRelease'):
+                entry['button'] = event.num
+            elif kind == 'Motion':
+                entry['state'] = event.state
+            elif kind == 'MouseWheel':
+                entry['delta'] = event.delta
+        self.events.append(entry)
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(dict(self.header, events=self.events), f, ensure_ascii=False)
+
+
+class PrefetchPlanner:
+    """根据最近的导航方向和速度规划预读窗口：前进方向按速度加宽，身后收窄，总数受缓存预算限制"""
+
+    def __init__(self, lookahead_seconds=1.0, max_ahead=32, history=8):
+        self.lookahead_seconds = lookahead_seconds
+        self.max_ahead = max_ahead
+        self.history = deque(maxlen=history)
+
+    def record(self, index):
+        self.history.append((time.monotonic(), index))
+
+    def velocity(self):
+        """最近的导航速度（张/秒），向后为负；停顿超过 1 秒视为静止"""
+        if len(self.history) < 2 or time.monotonic() - self.history[-1][0] > 1.0:
+            return 0.0
+        (t0, i0), (t1, i1) = self.history[0], self.history[-1]
+        if t1 - t0 <= 0:
+            return 0.0
+        return (i1 - i0) / (t1 - t0)
+
+    def plan(self, index, count, budget_images):
+        """返回按优先级排列的预读索引，沿前进方向的最近邻排在最前"""
+        velocity = self.velocity()
+        speed = abs(velocity)
+        if speed < 1.0:
+            direction, ahead, behind = 1, 1, 1
+        else:
+            direction = 1 if velocity > 0 else -1
+            ahead = math.ceil(speed * self.lookahead_seconds)
+            behind = 1 if speed < 5.0 else 0
+        ahead = max(1, min(ahead, self.max_ahead, budget_images - behind - 1))
+        indices = []
+        for step in range(1, max(ahead, behind) + 1):
+            if step <= ahead:
+                indices.append(index + direction * step)
+            if step <= behind:
+                indices.append(index - direction * step)
+        return [idx for idx in indices if 0 <= idx < count]
+
+
+class LoadScheduler:
+    """后台加载调度器：按优先级取任务（当前图片 > 相邻图片 > 预读 > 目录预热）
+
+    切换图片时用 replace() 重新给出需要的任务，不再需要的排队任务被取消。预热任务不入队，
+    队列空闲时才向 warmup_fn 索取下一张，因此总是围绕当前位置向外展开。
+    """
+
+    VISIBLE, NEIGHBOR, PREFETCH, WARMUP = range(4)
+
+    def __init__(self, load_fn, warmup_fn, workers):
+        self.load_fn = load_fn
+        self.warmup_fn = warmup_fn
+        self.queue = []
+        self.queued = {}
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.running = True
+        for i in range(workers):
+            threading.Thread(target=self.worker, daemon=True, name=f'loader-{i}').start()
+
+    def push(self, path, priority, order):
+        entry = self.queued.get(path)
+        if entry and (entry[0], entry[1]) <= (priority, order):
+            return
+        if entry:
+            entry[3] = None  # 堆中旧条目惰性删除
+        entry = [priority, order, next(self.counter), path]
+        self.queued[path] = entry
+        heapq.heappush(self.queue, entry)
+
+    def submit(self, path, priority, order=0):
+        with self.cond:
+            self.push(path, priority, order)
+            self.cond.notify()
+
+    def replace(self, wanted):
+        """wanted: {路径: (优先级, 次序)}；取消其它排队中的任务"""
+        with self.cond:
+            for path, entry in list(self.queued.items()):
+                if path not in wanted:
+                    entry[3] = None
+                    del self.queued[path]
+            for path, (priority, order) in wanted.items():
+                self.push(path, priority, order)
+            self.cond.notify_all()
+
+    def cancel_all(self):
+        self.replace({})
+
+    def wake(self):
+        with self.cond:
+            self.cond.notify_all()
+
+    def pop(self):
+        while self.queue:
+            entry = heapq.heappop(self.queue)
+            if entry[3] is not None:
+                del self.queued[entry[3]]
+                return entry
+        return None
+
+    def worker(self):
+        while self.running:
+            with self.cond:
+                entry = self.pop()
+            if entry is not None:
+                priority, path = entry[0], entry[3]
+            else:
+                path = self.warmup_fn()
+                priority = self.WARMUP
+                if path is None:
+                    with self.cond:
+                        if self.running and not self.queued:
+                            self.cond.wait()
+                    continue
+            try:
+                self.load_fn(path, priority)
+            except Exception as e:
+                print(f"后台加载失败 {path}: {e}")
+
+    def shutdown(self):
+        with self.cond:
+            self.running = False
+            self.queue.clear()
+            self.queued.clear()
+            self.cond.notify_all()
+
+
+def default_cache_dir():
+    base = os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME') \
+        or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'photo_viewer')
+
+
+class ThumbnailStore:
+    """持久化缩略图缓存（SQLite），按 路径+文件大小+修改时间 校验，超出容量后按最近访问时间淘汰
+
+    读取走只读连接，不会因为其它实例持有写锁而阻塞界面；访问时间和按内容摘要找到的副本先记在内存里，
+    由 flush（或下一次 put）在后台线程批量写入。
+    """
+
+    def __init__(self, cache_dir, max_bytes=256 * 1024 * 1024, thumb_size=(256, 256), use_content_hash=False):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.thumb_size = thumb_size
+        self.use_content_hash = use_content_hash
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(cache_dir, 'thumbnails.sqlite'), check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS thumbnails (
+            path TEXT PRIMARY KEY, file_size INTEGER, mtime_ns INTEGER, content_hash TEXT,
+            width INTEGER, height INTEGER, data BLOB, nbytes INTEGER, last_access REAL)''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS idx_thumbnails_access ON thumbnails(last_access)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS idx_thumbnails_hash ON thumbnails(content_hash)')
+        self.db.commit()
+        self.total_bytes = self.db.execute('SELECT COALESCE(SUM(nbytes), 0) FROM thumbnails').fetchone()[0]
+        db_uri = pathlib.Path(os.path.abspath(os.path.join(cache_dir, 'thumbnails.sqlite'))).as_uri()
+        self.reader = sqlite3.connect(f'{db_uri}?mode=ro', uri=True, check_same_thread=False)
+        self.read_lock = threading.Lock()
+        self.accessed = {}
+        self.copies = {}
+
+    @staticmethod
+    def content_hash(path, file_size):
+        """取文件头尾各 64KB 加文件大小计算摘要，避免读完整个大文件"""
+        chunk = 64 * 1024
+        digest = hashlib.blake2b(str(file_size).encode(), digest_size=16)
+        with open(path, 'rb') as f:
+            digest.update(f.read(chunk))
+            if file_size > chunk:
+                f.seek(max(chunk, file_size - chunk))
+                digest.update(f.read(chunk))
+        return digest.hexdigest()
+
+    def get(self, path):
+        """返回 (缩略图, 原图尺寸)；没有有效缓存时返回 None"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        with self.read_lock:
+            row = self.reader.execute('SELECT file_size, mtime_ns, width, height, data FROM thumbnails '
+                                      'WHERE path=?', (path,)).fetchone()
+        if row and (row[0], row[1]) != (st.st_size, st.st_mtime_ns):
+            row = None
+        if row is None and self.use_content_hash:
+            # 文件被复制或只改了修改时间：按内容摘要查找，副本稍后由 flush 写入
+            digest = self.content_hash(path, st.st_size)
+            with self.read_lock:
+                row = self.reader.execute('SELECT file_size, mtime_ns, width, height, data FROM thumbnails '
+                                          'WHERE content_hash=? LIMIT 1', (digest,)).fetchone()
+            if row:
+                with self.lock:
+                    self.copies[path] = (st, digest, (row[2], row[3]), row[4])
+        if row is None:
+            return None
+        with self.lock:
+            self.accessed[path] = time.time()
+        thumb = Image.open(io.BytesIO(row[4]))
+        thumb.load()
+        return thumb, (row[2], row[3])
+
+    def contains(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        with self.read_lock:
+            row = self.reader.execute('SELECT 1 FROM thumbnails WHERE path=? AND file_size=? AND mtime_ns=?',
+                                      (path, st.st_size, st.st_mtime_ns)).fetchone()
+        return row is not None
+
+    def put(self, path, img, full_size, transform=None):
+        """由已解码的图片生成缩略图并写入缓存；transform（通常是 EXIF 方向）作用在缩小后的缩略图上"""
+        st = os.stat(path)
+        # 直接缩小到缩略图尺寸，不复制整张位图；不放大小图
+        ratio = max(img.width / self.thumb_size[0], img.height / self.thumb_size[1], 1.0)
+        size = (max(1, round(img.width / ratio)), max(1, round(img.height / ratio)))
+        thumb = img.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+        if transform:
+            thumb = transform.apply(thumb)
+            full_size = transform.output_size(full_size)
+        buffer = io.BytesIO()
+        thumb.convert('RGB').save(buffer, 'JPEG', quality=85)
+        digest = self.content_hash(path, st.st_size) if self.use_content_hash else None
+        self.insert(path, st, digest, full_size, buffer.getvalue())
+        return thumb
+
+    def insert(self, path, st, digest, full_size, data):
+        with self.lock:
+            self.write_pending()
+            self.write_row(path, st, digest, full_size, data)
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+            self.db.commit()
+
+    def flush(self):
+        """把积累的访问时间和副本写入数据库；在后台线程调用"""
+        with self.lock:
+            if self.accessed or self.copies:
+                self.write_pending()
+                self.db.commit()
+
+    def write_pending(self):
+        copies, self.copies = self.copies, {}
+        accessed, self.accessed = self.accessed, {}
+        for path, (st, digest, full_size, data) in copies.items():
+            self.write_row(path, st, digest, full_size, data)
+        self.db.executemany('UPDATE thumbnails SET last_access=? WHERE path=?',
+                            [(when, path) for path, when in accessed.items()])
+
+    def write_row(self, path, st, digest, full_size, data):
+        old = self.db.execute('SELECT nbytes FROM thumbnails WHERE path=?', (path,)).fetchone()
+        self.db.execute('INSERT OR REPLACE INTO thumbnails VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (path, st.st_size, st.st_mtime_ns, digest, full_size[0], full_size[1],
+                         sqlite3.Binary(data), len(data), time.time()))
+        self.total_bytes += len(data) - (old[0] if old else 0)
+
+    def evict(self):
+        """淘汰最久未访问的缩略图，直到占用降到上限的 90%"""
+        target = self.max_bytes * 0.9
+        rows = self.db.execute('SELECT path, nbytes FROM thumbnails ORDER BY last_access').fetchall()
+        removed = []
+        for path, nbytes in rows:
+            if self.total_bytes <= target:
+                break
+            removed.append((path,))
+            self.total_bytes -= nbytes
+        self.db.executemany('DELETE FROM thumbnails WHERE path=?', removed)
+
+    def close(self):
+        with self.read_lock:
+            self.reader.close()
+        with self.lock:
+            self.db.close()
+
+
+class DirectoryIndex:
+    """持久化目录索引（SQLite）：文件列表、自然排序键、大小、修改时间、图片尺寸、格式、EXIF 方向和边缘主色
+
+    目录修改时间未变时直接返回上次排好序的列表；变化时只需对比每个文件的 stat 结果。
+    """
+
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS directories (path TEXT PRIMARY KEY, mtime_ns INTEGER)')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS entries (
+            directory TEXT, name TEXT, position INTEGER, sort_key TEXT, file_size INTEGER, mtime_ns INTEGER,
+            width INTEGER, height INTEGER, format TEXT, edge_color TEXT, orientation INTEGER,
+            PRIMARY KEY (directory, name))''')
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(entries)')]
+        for column, column_type in (('edge_color', 'TEXT'), ('orientation', 'INTEGER')):
+            if column not in columns:
+                self.db.execute(f'ALTER TABLE entries ADD COLUMN {column} {column_type}')
+        self.db.commit()
+
+    def load(self, directory):
+        """返回 (目录修改时间, 按排序位置排列的条目字典)；没有索引时返回 None"""
+        with self.lock:
+            row = self.db.execute('SELECT mtime_ns FROM directories WHERE path=?', (directory,)).fetchone()
+            if row is None:
+                return None
+            rows = self.db.execute('SELECT name, sort_key, file_size, mtime_ns, width, height, format, edge_color, '
+                                   'orientation FROM entries WHERE directory=? ORDER BY position',
+                                   (directory,)).fetchall()
+        entries = OrderedDict()
+        for name, sort_key, file_size, mtime_ns, width, height, image_format, edge_color, orientation in rows:
+            entries[name] = {'sort_key': sort_key, 'file_size': file_size, 'mtime_ns': mtime_ns,
+                             'width': width, 'height': height, 'format': image_format, 'edge_color': edge_color,
+                             'orientation': orientation}
+        return row[0], entries
+
+    def save(self, directory, mtime_ns, old_entries, entries):
+        """写回刷新后的目录：删除消失的文件，只更新位置或 stat 有变化的条目"""
+        old_entries = old_entries or {}
+        with self.lock:
+            removed = [(directory, name) for name in old_entries if name not in entries]
+            self.db.executemany('DELETE FROM entries WHERE directory=? AND name=?', removed)
+            changed = []
+            for position, (name, entry) in enumerate(entries.items()):
+                old = old_entries.get(name)
+                if old is None or old.get('position') != position or old['mtime_ns'] != entry['mtime_ns'] \
+                        or old['file_size'] != entry['file_size']:
+                    changed.append((directory, name, position, entry['sort_key'], entry['file_size'],
+                                    entry['mtime_ns'], entry['width'], entry['height'], entry['format'],
+                                    entry.get('edge_color'), entry.get('orientation')))
+            self.db.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', changed)
+            self.db.execute('INSERT OR REPLACE INTO directories VALUES (?, ?)', (directory, mtime_ns))
+            self.db.commit()
+
+    def record_image(self, path, meta):
+        """解码后补充图片尺寸、格式、EXIF 方向和边缘主色"""
+        width, height = meta['full_size']
+        edge_color = meta.get('edge_color')
+        edge_hex = '#%02x%02x%02x' % edge_color if edge_color else None
+        orientation = meta.get('orientation')
+        with self.lock:
+            self.db.execute('UPDATE entries SET width=?, height=?, format=?, edge_color=?, orientation=? '
+                            'WHERE directory=? AND name=? AND (width IS NULL OR width!=? OR height!=? '
+                            'OR edge_color IS NOT ? OR orientation IS NOT ?)',
+                            (width, height, meta.get('format'), edge_hex, orientation, os.path.dirname(path),
+                             os.path.basename(path), width, height, edge_hex, orientation))
+            self.db.commit()
+
+    def edge_color(self, path):
+        """返回已保存的边缘主色（十六进制），未知时返回 None"""
+        with self.lock:
+            row = self.db.execute('SELECT edge_color FROM entries WHERE directory=? AND name=?',
+                                  (os.path.dirname(path), os.path.basename(path))).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
 
 class ImageViewer:
     def __init__(self, root, initial_image=None):
@@ -40,9 +1245,120 @@ class ImageViewer:
         self.resize_timer = None
         self.is_playing = False
         self.playback_id = None
+
+        # 幻灯片：按目标帧率显示，提前解码约 slideshow_lookahead 秒的图片；
+        # 迟到策略 'skip' 按时钟跳过未就绪的图片以保持帧率，'hold' 逐张显示、未就绪时等待
+        self.slideshow_fps = 10.0
+        self.slideshow_policy = 'skip'
+        self.slideshow_lookahead = 1.0
+        self.slideshow_start = 0.0
+        self.slideshow_start_index = 0
+        self.slideshow_due = 0.0
+        self.slideshow_shown = 0
+        self.slideshow_dropped = 0
         self.loading_active = False
         self.zoom_factor = 1.0
         self.last_directory = None
+        self.scan_generation = 0
+        self.directory_watcher = None
+        self.background_animation = None
+
+        # 性能统计：加载、切换、重绘各阶段的滚动耗时，F3 切换左上角的浮层显示
+        self.perf = PerfStats()
+        self.process = psutil.Process()
+        self.hud = None
+        self.hud_id = None
+
+        # 性能跟踪：默认关闭；开启后记录 after 回调、输入事件、各阶段和缓存淘汰，可导出给 Perfetto 查看
+        self.trace_recorder = None
+
+        # 输入录制：记录事件流供 replay.py 重放；窗口尺寸动画设置的大小不算作用户调整
+        self.input_recorder = None
+        self.requested_window_size = None
+
+        # 按显示分辨率解码：JPEG 只解码到覆盖画布所需的尺寸，放大时再按需加载原图
+        self.display_resolution_decode = True
+        self.decode_target_size = (self.root.winfo_screenwidth(), self.root.winfo_screenheight())
+        self.image_meta = {}
+        self.full_res_pending = set()
+        # 原图超过缓存上限一半而被丢弃的图片，不再在每次放大时重复解码；文件变化或切换目录时清除
+        self.full_res_rejected = set()
+
+        # 非破坏性变换：path -> Transform，渲染时作用于视口，导出时才应用到原图
+        self.transforms = {}
+
+        # 多进程解码：缓存的位图可能映射在共享内存块上
+        self.cache_lock = threading.RLock()
+        self.inflight_loads = {}
+        self.shared_blocks = {}
+        try:
+            self.decode_service = DecodeService()
+        except (OSError, NotImplementedError) as e:
+            print(f"无法启动解码进程池，改为进程内解码: {e}")
+            self.decode_service = None
+        self.preload_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix='preload')
+        # 预渲染帧环单独使用线程：预热时 preload_executor 里排着成百上千的缩略图和索引任务，
+        # 相邻图片的显示帧不能排在它们后面
+        self.frame_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix='frame')
+
+        # 预读窗口随导航速度变化，所有后台加载经由优先级调度器
+        self.prefetch_planner = PrefetchPlanner()
+        self.loading_dialog = None
+        self.warmup_lock = threading.Lock()
+        self.warmup_attempted = set()
+        self.warmup_center = 0
+        self.warmup_radius = 0
+        self.warmup_loaded = 0
+        self.warmup_bytes_only = False
+        self.load_scheduler = LoadScheduler(
+            self.run_scheduled_load, self.next_warmup_path,
+            self.decode_service.max_workers if self.decode_service else 2)
+
+        # 预渲染帧环：path -> (缓存图片, 变换, 画布尺寸, PhotoImage)，相邻图片按当前画布大小提前缩放，
+        # 切换时直接替换画布图像；图片被替换（变换、加载原图）或画布尺寸改变后自动作废
+        self.frame_ring = OrderedDict()
+        self.frame_ring_size = 4
+        self.frame_pending = set()
+
+        # 动画 GIF/WebP 播放：帧在后台按显示尺寸解码，由 after 按每帧的时长调度
+        self.animation = None
+        self.animation_id = None
+        self.animation_index = 0
+        self.animation_due = 0.0
+        self.animation_photo = None
+
+        # 渲染结果缓存：(path, 变换, 视口, 输出尺寸, 重采样方式) -> (缓存图片, PhotoImage, 字节数)，
+        # 重复的视图（来回缩放、恢复适应窗口）直接复用，按字节数做 LRU 淘汰
+        self.render_cache = OrderedDict()
+        self.render_cache_size = 0
+        self.render_cache_limit = 0
+
+        # 多分辨率金字塔：path -> (基准图片, [1/2, 1/4, ...], 字节数)，首次缩小显示时在后台生成
+        self.pyramids = {}
+        self.pyramid_pending = set()
+        self.pyramid_min_side = 256
+
+        # 分块后端：超过此像素数（或缓存上限的 1/4）的图片不做整图解码
+        self.tiled_pixel_threshold = 100_000_000
+        self.tile_size = 512
+        self.tile_store_root = os.path.join(default_cache_dir(), 'tiles')
+        self.tile_store_limit = 2 * 1024 * 1024 * 1024
+        # 正在切块的分块目录；只为显示中的图片切块，预取和预热只登记不切块
+        self.tile_store_pending = set()
+
+        # 持久化缩略图缓存：首屏先显示缩略图，总览窗口直接读取
+        try:
+            self.thumbnail_store = ThumbnailStore(os.path.join(default_cache_dir(), 'thumbnails'))
+        except (OSError, sqlite3.Error) as e:
+            print(f"无法打开缩略图缓存: {e}")
+            self.thumbnail_store = None
+
+        # 持久化目录索引：重复打开同一目录时只处理变化的文件
+        try:
+            self.directory_index = DirectoryIndex(os.path.join(default_cache_dir(), 'directories.sqlite'))
+        except (OSError, sqlite3.Error) as e:
+            print(f"无法打开目录索引: {e}")
+            self.directory_index = None
 
         # Memory management
         self.cache_size_limit = 0
@@ -50,6 +1366,11 @@ class ImageViewer:
         self.image_cache = {}
         self.lru_list = OrderedDict()
 
+        # 第二级缓存：未解码的文件字节，位图未命中时在内存中解码而不是读盘
+        self.file_cache_limit = 0
+        self.file_cache_size = 0
+        self.file_cache = OrderedDict()
+
         # Navigation speed control
         self.navigate_delay = 50
         self.speed_boost = 0.90
@@ -59,9 +1380,11 @@ class ImageViewer:
 
         # Bind other events
         self.root.bind('<Configure>', self.on_resize)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         self.root.bind('<Left>', lambda e: "break")
         self.root.bind('<Right>', lambda e: "break")
         self.root.bind('<space>', self.toggle_playback)
+        self.root.bind('<F3>', self.toggle_hud)
         self.canvas.bind('<MouseWheel>', self.on_mousewheel)
 
         # Create menu
@@ -77,11 +1400,35 @@ class ImageViewer:
 
         file_menu = tk.Menu(menubar, tearoff=0)
         file_menu.add_command(label="打开", command=self.open_image)
+        file_menu.add_command(label="缩略图总览", command=self.show_thumbnail_overview)
+        file_menu.add_command(label="导出变换后的图片", command=self.export_image)
+        file_menu.add_separator()
+        self.trace_var = tk.BooleanVar(value=False)
+        file_menu.add_checkbutton(label="记录性能跟踪", variable=self.trace_var, command=self.toggle_trace)
+        file_menu.add_command(label="导出性能跟踪...", command=self.export_trace)
+        self.record_var = tk.BooleanVar(value=False)
+        file_menu.add_checkbutton(label="录制输入", variable=self.record_var, command=self.toggle_input_recording)
+        file_menu.add_command(label="保存输入录制...", command=self.save_input_recording)
 
         play_menu = tk.Menu(menubar, tearoff=0)
         play_menu.add_command(label="播放/暂停", command=self.toggle_playback)
         play_menu.add_command(label="停止", command=self.stop_playback)
 
+        self.slideshow_fps_var = tk.DoubleVar(value=self.slideshow_fps)
+        speed_menu = tk.Menu(play_menu, tearoff=0)
+        for fps in (2, 5, 10, 30):
+            speed_menu.add_radiobutton(label=f"{fps} 张/秒", variable=self.slideshow_fps_var, value=float(fps),
+                                       command=self.set_slideshow_fps)
+        play_menu.add_cascade(label="播放速度", menu=speed_menu)
+
+        self.slideshow_policy_var = tk.StringVar(value=self.slideshow_policy)
+        policy_menu = tk.Menu(play_menu, tearoff=0)
+        policy_menu.add_radiobutton(label="跳过（保持帧率）", variable=self.slideshow_policy_var, value='skip',
+                                    command=self.set_slideshow_policy)
+        policy_menu.add_radiobutton(label="等待（逐张显示）", variable=self.slideshow_policy_var, value='hold',
+                                    command=self.set_slideshow_policy)
+        play_menu.add_cascade(label="图片未就绪时", menu=policy_menu)
+
         image_menu = tk.Menu(menubar, tearoff=0)
         image_menu.add_command(label="图片详细信息", command=self.show_image_info)
 
@@ -95,6 +1442,9 @@ class ImageViewer:
         image_menu.add_command(label="水平翻转", command=self.flip_horizontal)
         image_menu.add_command(label="垂直翻转", command=self.flip_vertical)
         image_menu.add_command(label="自定义旋转", command=self.custom_rotate)
+        image_menu.add_separator()
+        self.hud_var = tk.BooleanVar(value=False)
+        image_menu.add_checkbutton(label="性能信息 (F3)", variable=self.hud_var, command=self.toggle_hud)
 
         menubar.add_cascade(label="文件", menu=file_menu)
         menubar.add_cascade(label="播放控制", menu=play_menu)
@@ -108,12 +1458,13 @@ class ImageViewer:
         img_data = self.image_cache.get(current_path)
         if not img_data:
             return
-        img, size = img_data
-        flipped_img = img.transpose(Image.FLIP_LEFT_RIGHT)
-        self.image_cache[current_path] = (flipped_img, size)
-        img_width = flipped_img.width
-        self.viewport_x = img_width - (self.viewport_x + self.viewport_width)
+        img, _ = img_data
+        self.transforms[current_path] = self.get_transform(current_path).flipped_horizontal()
+        view_width, _ = self.view_size(current_path, img)
+        self.viewport_x = view_width - (self.viewport_x + self.viewport_width)
         self.fast_redraw()
+        if self.animation:
+            self.start_animation()
 
     def flip_vertical(self):
         if not self.image_paths or self.is_playing:
@@ -122,12 +1473,13 @@ class ImageViewer:
         img_data = self.image_cache.get(current_path)
         if not img_data:
             return
-        img, size = img_data
-        flipped_img = img.transpose(Image.FLIP_TOP_BOTTOM)
-        self.image_cache[current_path] = (flipped_img, size)
-        img_height = flipped_img.height
-        self.viewport_y = img_height - (self.viewport_y + self.viewport_height)
+        img, _ = img_data
+        self.transforms[current_path] = self.get_transform(current_path).flipped_vertical()
+        _, view_height = self.view_size(current_path, img)
+        self.viewport_y = view_height - (self.viewport_y + self.viewport_height)
         self.fast_redraw()
+        if self.animation:
+            self.start_animation()
 
     def custom_rotate(self):
         if not self.image_paths or self.is_playing:
@@ -152,19 +1504,21 @@ class ImageViewer:
         tk.Button(dialog, text="确认", command=on_submit).pack(pady=5)
         dialog.bind('<Return>', lambda e: on_submit())
 
-    def rotate_image(self, angle):
-        current_path = self.image_paths[self.current_index]
+    def rotate_image(self, angle, path=None):
+        current_path = self.image_paths[self.current_index] if self.image_paths else None
+        path = path or current_path
+        if path is None:
+            return
+        self.transforms[path] = self.get_transform(path).rotated(angle)
         img_data = self.image_cache.get(current_path)
-        if not img_data:
+        if path != current_path or not img_data:
             return
-        img, size = img_data
-        rotated_img = img.rotate(angle, expand=True, resample=Image.BICUBIC)
-        self.image_cache[current_path] = (rotated_img, size)
+        self.zoom_factor = 1.0
         self.viewport_x = 0
         self.viewport_y = 0
-        self.viewport_width = rotated_img.width
-        self.viewport_height = rotated_img.height
-        self.fast_redraw()
+        self.viewport_width, self.viewport_height = self.view_size(current_path, img_data[0])
+        self.high_quality_redraw()
+        self.start_animation()
 
     def animate_rotate(self, target_angle):
         if not self.image_paths or self.is_playing:
@@ -174,51 +1528,91 @@ class ImageViewer:
         if not img_data:
             return
         img, size = img_data
+        window_width = self.canvas.winfo_width()
+        window_height = self.canvas.winfo_height()
+        if window_width < 10 or window_height < 10:
+            return
+        self.stop_animation()
 
         steps = 10
         duration = 500
         step_time = duration // steps
 
+        # 动画帧只在适应窗口大小的代理图上旋转，内存和耗时与窗口大小成正比
+        view_width, view_height = self.view_size(current_path, img)
+        proxy_size = self.fit_size(view_width, view_height, window_width, window_height)
+        proxy = self.render_view(current_path, img, (0, 0, view_width, view_height), proxy_size,
+                                 Image.Resampling.BILINEAR)
+        if proxy is None:
+            self.rotate_image(target_angle)
+            return
         self.root.title(f"正在处理[{target_angle}°]中")
 
-        def compute_frame(step):
-            progress = self.ease_in_out(step, steps)
-            current_angle = target_angle * progress
-            return img.rotate(current_angle, expand=True, resample=Image.BICUBIC)
-
-        def precompute_frames(img, target_angle, steps, callback):
-            frame_cache = [None] * (steps + 1)
-            with concurrent.futures.ThreadPoolExecutor(max_workers=min(steps + 1, os.cpu_count() or 4)) as executor:
-                futures = {executor.submit(compute_frame, step): step for step in range(steps + 1)}
-                for future in concurrent.futures.as_completed(futures):
-                    step = futures[future]
-                    frame_cache[step] = future.result()
-            callback(frame_cache)
-
-        def on_frames_ready(frame_cache):
-            def update_frame(step=0):
-                if step > steps:
-                    self.image_cache[current_path] = (frame_cache[-1], size)
-                    self.viewport_x = 0
-                    self.viewport_y = 0
-                    self.viewport_width = frame_cache[-1].width
-                    self.viewport_height = frame_cache[-1].height
-                    self.fast_redraw()
+        def update_frame(step=0):
+            if step > steps or not self.image_paths or self.image_paths[self.current_index] != current_path:
+                # 动画结束（或已切换到其它图片）时才记录变换，图片本身不做任何处理
+                self.rotate_image(target_angle, current_path)
+                if self.image_paths and self.image_paths[self.current_index] == current_path:
                     self.root.title(f"图片查看器 - {os.path.basename(current_path)}")
-                    return
-                rotated_img = frame_cache[step]
-                self.image_cache[current_path] = (rotated_img, size)
-                self.viewport_x = 0
-                self.viewport_y = 0
-                self.viewport_width = rotated_img.width
-                self.viewport_height = rotated_img.height
-                self.fast_redraw()
-                self.root.after(step_time, update_frame, step + 1)
-
-            update_frame(0)
+                return
+            progress = self.ease_in_out(step, steps)
+            frame = proxy.rotate(target_angle * progress, expand=True, resample=Image.BILINEAR)
+            frame = frame.resize(self.fit_size(frame.width, frame.height, window_width, window_height),
+                                 Image.Resampling.BILINEAR)
+            tk_img = ImageTk.PhotoImage(frame)
+            self.canvas.delete("all")
+            self.canvas.create_image(window_width // 2, window_height // 2, anchor=tk.CENTER, image=tk_img)
+            self.canvas.image = tk_img
+            self.root.after(step_time, update_frame, step + 1)
+
+        update_frame(0)
+
+    def get_transform(self, path):
+        return self.transforms.get(path, IDENTITY_TRANSFORM)
+
+    def view_size(self, path, img):
+        """变换后（显示坐标中）的图片尺寸"""
+        return self.get_transform(path).output_size(img.size)
+
+    def export_image(self):
+        """以原始分辨率应用当前变换，另存为新文件"""
+        if not self.image_paths:
+            return
+        current_path = self.image_paths[self.current_index]
+        transform = self.get_transform(current_path)
+        name, ext = os.path.splitext(os.path.basename(current_path))
+        file_path = filedialog.asksaveasfilename(
+            initialdir=os.path.dirname(current_path), initialfile=f"{name}_edited{ext}", defaultextension=ext,
+            filetypes=[("图片文件", "*.jpg;*.jpeg;*.png;*.bmp;*.gif;*.webp;*.tiff"), ("所有文件", "*.*")])
+        if not file_path:
+            return
+        self.root.title(f"正在导出 {os.path.basename(file_path)}...")
 
-        threading.Thread(target=precompute_frames, args=(img, target_angle, steps, on_frames_ready),
-                         daemon=True).start()
+        def bake():
+            try:
+                with Image.open(current_path) as original:
+                    if original.mode not in ('RGB', 'RGBA', 'L'):
+                        original = original.convert('RGBA' if 'transparency' in original.info
+                                                    or original.mode.endswith('A') else 'RGB')
+                    result = transform.apply(original)
+                if result.mode == 'RGBA' and os.path.splitext(file_path)[1].lower() in ('.jpg', '.jpeg', '.bmp'):
+                    result = result.convert('RGB')
+                result.save(file_path, quality=95)
+                error = None
+            except (OSError, ValueError) as e:
+                error = e
+            self.root.after(0, self.on_export_done, current_path, file_path, error)
+
+        threading.Thread(target=bake, daemon=True).start()
+
+    def on_export_done(self, path, file_path, error):
+        if self.image_paths and self.image_paths[self.current_index] == path:
+            self.root.title(f"图片查看器 - {os.path.basename(path)}")
+        if error:
+            print(f"无法导出图片 {file_path}: {error}")
+            messagebox.showerror("错误", f"无法导出图片：{error}")
+        else:
+            messagebox.showinfo("提示", f"已导出到 {file_path}")
 
     def ease_in_out(self, step, total_steps):
         """非线性缓动函数（二次缓动）"""
@@ -246,7 +1640,7 @@ class ImageViewer:
         self.animate_rotate(-180)
 
     def analyze_edge_colors(self):
-        """分析图片边缘颜色占比并以动画形式调整背景颜色"""
+        """按图片边缘主色以动画形式调整背景颜色；主色通常在解码时已算好，否则在此同步计算并记住"""
         if not self.image_paths:
             return
         current_path = self.image_paths[self.current_index]
@@ -254,61 +1648,56 @@ class ImageViewer:
         if not img_data:
             return
         img, _ = img_data
-
-        def compute_dominant_color():
-            # 提取边缘像素
-            width, height = img.size
-            edge_pixels = []
-            for x in range(width):  # 上边缘
-                edge_pixels.append(img.getpixel((x, 0)))
-            for x in range(width):  # 下边缘
-                edge_pixels.append(img.getpixel((x, height - 1)))
-            for y in range(height):  # 左边缘
-                edge_pixels.append(img.getpixel((0, y)))
-            for y in range(height):  # 右边缘
-                edge_pixels.append(img.getpixel((width - 1, y)))
-
-            # 计算主导颜色
-            color_counts = Counter(edge_pixels)
-            dominant_color = color_counts.most_common(1)[0][0]  # RGB 元组
-            target_hex = f"#{dominant_color[0]:02x}{dominant_color[1]:02x}{dominant_color[2]:02x}"
-
-            # 获取当前背景颜色
-            current_hex = self.canvas['bg']
-            try:
-                # 将十六进制颜色转换为 RGB
-                current_rgb = tuple(int(current_hex.lstrip('#')[i:i+2], 16) for i in (0, 2, 4))
-            except ValueError:
-                current_rgb = (51, 51, 51)  # 默认 #333333
-
-            # 动画参数
-            steps = 20  # 动画帧数
-            duration = 500  # 总时长（毫秒）
-            step_time = duration // steps
-
-            def interpolate_color(start_rgb, end_rgb, progress):
-                """计算两颜色之间的插值"""
-                r = int(start_rgb[0] + (end_rgb[0] - start_rgb[0]) * progress)
-                g = int(start_rgb[1] + (end_rgb[1] - start_rgb[1]) * progress)
-                b = int(start_rgb[2] + (end_rgb[2] - start_rgb[2]) * progress)
-                return f"#{r:02x}{g:02x}{b:02x}"
-
-            def animate_transition(step=0):
-                if step > steps:
-                    self.canvas.config(bg=target_hex)  # 确保最后一帧精确
+        meta = self.image_meta.get(current_path)
+        dominant_color = meta.get('edge_color') if meta else None
+        if dominant_color is None:
+            if isinstance(img, TiledImage):
+                img = img.overview()
+                if img is None:
                     return
-                progress = step / steps
-                # 使用非线性缓动（可选）
-                eased_progress = self.ease_in_out(step, steps)
-                new_color = interpolate_color(current_rgb, dominant_color, eased_progress)
-                self.canvas.config(bg=new_color)
-                self.root.after(step_time, animate_transition, step + 1)
+            dominant_color = dominant_edge_color(img)
+            if meta is not None:
+                meta['edge_color'] = dominant_color
+        self.animate_background(dominant_color)
+
+    def animate_background(self, dominant_color):
+        target_hex = f"#{dominant_color[0]:02x}{dominant_color[1]:02x}{dominant_color[2]:02x}"
+        if self.background_animation:
+            self.root.after_cancel(self.background_animation)
+            self.background_animation = None
+
+        # 获取当前背景颜色
+        current_hex = self.canvas['bg']
+        try:
+            # 将十六进制颜色转换为 RGB
+            current_rgb = tuple(int(current_hex.lstrip('#')[i:i+2], 16) for i in (0, 2, 4))
+        except ValueError:
+            current_rgb = (51, 51, 51)  # 默认 #333333
 
-            # 在主线程中启动动画
-            self.root.after(0, animate_transition)
+        # 动画参数
+        steps = 20  # 动画帧数
+        duration = 500  # 总时长（毫秒）
+        step_time = duration // steps
 
-        # 在单独线程中计算颜色
-        threading.Thread(target=compute_dominant_color, daemon=True).start()
+        def interpolate_color(start_rgb, end_rgb, progress):
+            """计算两颜色之间的插值"""
+            r = int(start_rgb[0] + (end_rgb[0] - start_rgb[0]) * progress)
+            g = int(start_rgb[1] + (end_rgb[1] - start_rgb[1]) * progress)
+            b = int(start_rgb[2] + (end_rgb[2] - start_rgb[2]) * progress)
+            return f"#{r:02x}{g:02x}{b:02x}"
+
+        def animate_transition(step=0):
+            if step > steps:
+                self.canvas.config(bg=target_hex)  # 确保最后一帧精确
+                self.background_animation = None
+                return
+            # 使用非线性缓动
+            eased_progress = self.ease_in_out(step, steps)
+            new_color = interpolate_color(current_rgb, dominant_color, eased_progress)
+            self.canvas.config(bg=new_color)
+            self.background_animation = self.root.after(step_time, animate_transition, step + 1)
+
+        animate_transition()
 
     def on_mousewheel(self, event):
         if not self.image_paths or self.is_playing or hasattr(self, '_zoom_cooldown'):
@@ -317,11 +1706,8 @@ class ImageViewer:
         mouse_x = event.x
         mouse_y = event.y
         img_x, img_y = self.canvas_to_image_coords(mouse_x, mouse_y)
-        old_center = (self.viewport_x + self.viewport_width / 2, self.viewport_y + self.viewport_height / 2)
         scale = 1.3 if event.delta > 0 else 1 / 1.3
         self.zoom_at_point(img_x, img_y, scale)
-        new_center = (self.viewport_x + self.viewport_width / 2, self.viewport_y + self.viewport_height / 2)
-        print(f"Mouse: ({img_x}, {img_y}), Old Center: {old_center}, New Center: {new_center}")
         self.fast_redraw()
         if hasattr(self, '_high_quality_timer'):
             self.root.after_cancel(self._high_quality_timer)
@@ -342,8 +1728,6 @@ class ImageViewer:
         rel_y = (canvas_y - img_top) / display_height
         img_x = self.viewport_x + rel_x * self.viewport_width
         img_y = self.viewport_y + rel_y * self.viewport_height
-        # 添加调试信息
-        print(f"Canvas: ({canvas_x}, {canvas_y}) -> Image: ({img_x}, {img_y})")
         return img_x, img_y
 
 
@@ -372,34 +1756,262 @@ class ImageViewer:
         info_dialog.transient(self.root)
         info_dialog.grab_set()
 
-    def redraw_image(self, img, resample_method):
+    def redraw_image(self, img, resample_method, path=None):
         window_width = self.canvas.winfo_width()
         window_height = self.canvas.winfo_height()
         if window_width < 10 or window_height < 10:
             return
+        with self.perf.stage('redraw'):
+            self.draw_view(img, resample_method, path, window_width, window_height)
 
+    def draw_view(self, img, resample_method, path, window_width, window_height):
         box = (int(self.viewport_x), int(self.viewport_y),
                int(self.viewport_x + self.viewport_width), int(self.viewport_y + self.viewport_height))
-        cropped_img = img.crop(box)
 
         if self.zoom_factor == 1.0:
-            aspect_ratio = self.viewport_width / self.viewport_height
-            window_aspect = window_width / window_height
-            if window_aspect > aspect_ratio:
-                new_height = window_height
-                new_width = int(new_height * aspect_ratio)
-            else:
-                new_width = window_width
-                new_height = int(new_width / aspect_ratio)
+            new_width, new_height = self.fit_size(self.viewport_width, self.viewport_height,
+                                                  window_width, window_height)
         else:
             new_width = window_width
             new_height = window_height
 
-        resized_img = cropped_img.resize((new_width, new_height), resample_method)
-        tk_img = ImageTk.PhotoImage(resized_img)
+        transform = self.get_transform(path) if path is not None else IDENTITY_TRANSFORM
+        key = (path, transform, box, (new_width, new_height), resample_method)
+        tk_img = self.get_cached_render(key, img) if path is not None else None
+        if path is not None:
+            self.perf.count('render', tk_img is not None)
+        if tk_img is None:
+            with self.perf.stage('redraw.render'):
+                resized_img = self.render_view(path, img, box, (new_width, new_height), resample_method)
+            if resized_img is None:
+                self.build_tile_store(path, img)
+                self.canvas.delete("all")
+                self.canvas.create_text(window_width // 2, window_height // 2, text="正在生成分块...", fill='white')
+                return
+            with self.perf.stage('redraw.photo'):
+                tk_img = self.make_photo(resized_img)
+            if path is not None:
+                self.store_render(key, img, tk_img, new_width * new_height * 4)
+        with self.perf.stage('redraw.canvas'):
+            self.canvas.delete("all")
+            self.canvas.create_image(window_width // 2, window_height // 2, anchor=tk.CENTER, image=tk_img)
+            self.canvas.image = tk_img
+
+    def make_photo(self, img):
+        return ImageTk.PhotoImage(img)
+
+    def render_view(self, path, img, box, output_size, resample):
+        """把显示坐标中的 box 渲染为 output_size；变换只作用在视口区域上，缓存的位图保持原样
+
+        分块图片尚未就绪时返回 None。
+        """
+        transform = self.get_transform(path) if path is not None else IDENTITY_TRANSFORM
+        if transform.is_identity:
+            return self.render_source(path, img, box, output_size, resample)
+        if transform.is_orthogonal:
+            # 直角旋转和翻转：按原图方向取出对应区域并缩放，再精确换位
+            region_size = output_size[::-1] if transform.angle in (90, 270) else output_size
+            region = self.render_source(path, img, transform.source_box(img.size, box), region_size, resample)
+            return transform.apply(region) if region is not None else None
+        # 任意角度：先按不高于原图的密度取出视口对应的原图外接区域，再做一次仿射变换
+        x0, y0, x1, y1 = transform.source_box(img.size, box)
+        x0, y0, x1, y1 = math.floor(x0), math.floor(y0), math.ceil(x1), math.ceil(y1)
+        if x1 <= x0 or y1 <= y0:
+            return Image.new('RGB', output_size)
+        density = min(1.0, output_size[0] / (box[2] - box[0]), output_size[1] / (box[3] - box[1]))
+        region_size = (max(1, round((x1 - x0) * density)), max(1, round((y1 - y0) * density)))
+        region = self.render_source(path, img, (x0, y0, x1, y1), region_size, resample)
+        if region is None:
+            return None
+        a, b, c, d, e, f = transform.affine(img.size, box, output_size)
+        rx = region.width / (x1 - x0)
+        ry = region.height / (y1 - y0)
+        data = (a * rx, b * rx, (c - x0) * rx, d * ry, e * ry, (f - y0) * ry)
+        return region.transform(output_size, Image.Transform.AFFINE, data,
+                                AFFINE_RESAMPLE.get(resample, Image.Resampling.BICUBIC))
+
+    def render_source(self, path, img, box, output_size, resample):
+        """把原图坐标中的 box 缩放为 output_size，不考虑变换"""
+        if isinstance(img, TiledImage):
+            region = img.render(box, output_size, resample)
+            self.account_tiles(path, img)
+            return region
+        # 从金字塔中选择仍不低于屏幕像素密度的最小层级
+        source, box = img, tuple(box)
+        if path is not None:
+            source, box = self.select_pyramid_level(path, img, box, output_size)
+        return source.resize(output_size, resample, box=box)
+
+    def get_cached_render(self, key, img):
+        """查找渲染缓存；快速重绘时同一视图的高质量结果也可直接使用"""
+        keys = [key]
+        if key[4] != Image.Resampling.LANCZOS:
+            keys.insert(0, key[:4] + (Image.Resampling.LANCZOS,))
+        for candidate in keys:
+            entry = self.render_cache.get(candidate)
+            if not entry:
+                continue
+            if entry[0] is not img:
+                # 缓存图片已被替换（变换或加载原图），结果作废
+                self.drop_render(candidate)
+                continue
+            self.render_cache.move_to_end(candidate)
+            return entry[1]
+        return None
+
+    def store_render(self, key, img, tk_img, nbytes):
+        if nbytes > self.render_cache_limit // 4:
+            return
+        self.drop_render(key)
+        self.render_cache[key] = (img, tk_img, nbytes)
+        self.render_cache_size += nbytes
+        while self.render_cache_size > self.render_cache_limit and self.render_cache:
+            oldest = next(iter(self.render_cache))
+            self.perf.mark('evict.render', path=os.path.basename(oldest[0]), bytes=self.render_cache[oldest][2])
+            self.drop_render(oldest)
+
+    def drop_render(self, key):
+        entry = self.render_cache.pop(key, None)
+        if entry:
+            self.render_cache_size -= entry[2]
+
+    @staticmethod
+    def fit_size(width, height, window_width, window_height):
+        aspect_ratio = width / height
+        window_aspect = window_width / window_height
+        if window_aspect > aspect_ratio:
+            new_height = window_height
+            new_width = int(new_height * aspect_ratio)
+        else:
+            new_width = window_width
+            new_height = int(new_width / aspect_ratio)
+        return new_width, new_height
+
+    def prerender_neighbors(self):
+        """为即将访问的相邻图片（播放时为接下来的几张）在后台生成适应窗口大小的显示帧"""
+        if not self.image_paths:
+            return
+        canvas_size = (self.canvas.winfo_width(), self.canvas.winfo_height())
+        if canvas_size[0] < 10 or canvas_size[1] < 10:
+            return
+        if self.is_playing:
+            indices = self.slideshow_indices()
+        else:
+            indices = self.prefetch_planner.plan(self.current_index, len(self.image_paths), self.frame_ring_size)
+        for idx in indices[:self.frame_ring_size - 1]:
+            path = self.image_paths[idx]
+            img_data = self.image_cache.get(path)
+            if not img_data or isinstance(img_data[0], TiledImage) or path in self.frame_pending:
+                continue
+            transform = self.get_transform(path)
+            entry = self.frame_ring.get(path)
+            if entry and entry[0] is img_data[0] and entry[1] == transform and entry[2] == canvas_size:
+                continue
+            self.frame_pending.add(path)
+            self.frame_executor.submit(self.render_frame, path, img_data[0], canvas_size)
+
+    def render_frame(self, path, img, canvas_size):
+        transform = self.get_transform(path)
+        try:
+            view_width, view_height = transform.output_size(img.size)
+            size = self.fit_size(view_width, view_height, *canvas_size)
+            with self.perf.stage('prerender'):
+                frame = self.render_view(path, img, (0, 0, view_width, view_height), size, Image.Resampling.LANCZOS)
+            if frame.mode not in ("RGB", "RGBA", "L"):
+                frame = frame.convert("RGB")  # PhotoImage 只接受这些模式，提前在后台转换
+        except ValueError:
+            frame = None  # 图片已被淘汰关闭
+        self.root.after(0, self.store_frame, path, img, transform, canvas_size, frame)
+
+    def store_frame(self, path, img, transform, canvas_size, frame):
+        self.frame_pending.discard(path)
+        if frame is None:
+            return
+        img_data = self.image_cache.get(path)
+        if not img_data or img_data[0] is not img or self.get_transform(path) != transform:
+            return
+        if canvas_size != (self.canvas.winfo_width(), self.canvas.winfo_height()):
+            return
+        self.frame_ring[path] = (img, transform, canvas_size, ImageTk.PhotoImage(frame))
+        self.frame_ring.move_to_end(path)
+        while len(self.frame_ring) > self.frame_ring_size:
+            old_path, _ = self.frame_ring.popitem(last=False)
+            self.perf.mark('evict.frame', path=os.path.basename(old_path))
+
+    def show_prerendered_frame(self, path, img):
+        """命中预渲染帧时只替换画布图像，返回是否命中"""
+        entry = self.frame_ring.get(path)
+        window_width = self.canvas.winfo_width()
+        window_height = self.canvas.winfo_height()
+        if not entry or entry[0] is not img or entry[1] != self.get_transform(path) \
+                or entry[2] != (window_width, window_height):
+            return False
+        self.frame_ring.move_to_end(path)
         self.canvas.delete("all")
-        self.canvas.create_image(window_width // 2, window_height // 2, anchor=tk.CENTER, image=tk_img)
-        self.canvas.image = tk_img
+        self.canvas.create_image(window_width // 2, window_height // 2, anchor=tk.CENTER, image=entry[3])
+        self.canvas.image = entry[3]
+        return True
+
+    def start_animation(self):
+        """当前图片是动画且处于适应窗口状态时开始播放"""
+        self.stop_animation()
+        if not self.image_paths or self.is_playing or self.zoom_factor != 1.0:
+            return
+        current_path = self.image_paths[self.current_index]
+        meta = self.image_meta.get(current_path)
+        window_width = self.canvas.winfo_width()
+        window_height = self.canvas.winfo_height()
+        if not meta or not meta.get('animated') or window_width < 10 or window_height < 10:
+            return
+        budget = max(16 * 1024 * 1024, self.render_cache_limit // 2)
+        self.animation = AnimationDecoder(current_path, (window_width, window_height),
+                                          self.get_transform(current_path), budget)
+        self.animation_index = 0
+        self.animation_due = time.monotonic()
+        self.animation_id = self.root.after(0, self.play_animation_frame)
+
+    def play_animation_frame(self):
+        self.animation_id = None
+        decoder = self.animation
+        if decoder is None:
+            return
+        entry = decoder.take(self.animation_index)
+        if entry is None:
+            if decoder.error:
+                print(f"无法播放动画 {decoder.path}: {decoder.error}")
+                self.stop_animation()
+                return
+            # 解码没跟上：保持当前帧，稍后再试
+            self.animation_id = self.root.after(10, self.play_animation_frame)
+            return
+        frame, duration = entry
+        window_width = self.canvas.winfo_width()
+        window_height = self.canvas.winfo_height()
+        photo = self.animation_photo
+        if photo is not None and self.canvas.image is photo and (photo.width(), photo.height()) == frame.size:
+            photo.paste(frame)  # 复用同一个 Tk 图像，只替换像素
+        else:
+            self.animation_photo = ImageTk.PhotoImage(frame)
+            self.canvas.delete("all")
+            self.canvas.create_image(window_width // 2, window_height // 2, anchor=tk.CENTER,
+                                     image=self.animation_photo)
+            self.canvas.image = self.animation_photo
+        self.animation_index = (self.animation_index + 1) % decoder.frame_count
+        # 按截止时间排程，避免误差累积；落后不超过一帧时尽快补上，超过一帧时从现在重新计时
+        now = time.monotonic()
+        due = self.animation_due + duration / 1000
+        self.animation_due = now if now - due > duration / 1000 else due
+        self.animation_id = self.root.after(max(1, int((self.animation_due - now) * 1000)),
+                                            self.play_animation_frame)
+
+    def stop_animation(self):
+        if self.animation_id:
+            self.root.after_cancel(self.animation_id)
+            self.animation_id = None
+        if self.animation:
+            self.animation.stop()
+            self.animation = None
+        self.animation_photo = None
 
     def zoom_at_point(self, img_x, img_y, scale):
         if not self.image_paths or self.is_playing:
@@ -422,20 +2034,180 @@ class ImageViewer:
         if new_width < 10 or new_height < 10:
             return
 
+        view_width, view_height = self.view_size(current_path, img)
         if self.zoom_factor == 1.0:
-            self.viewport_width = img.width
-            self.viewport_height = img.height
+            self.viewport_width = view_width
+            self.viewport_height = view_height
             self.viewport_x = 0
             self.viewport_y = 0
         else:
             self.viewport_x = img_x - rel_x * new_width
             self.viewport_y = img_y - rel_y * new_height
-            self.viewport_x = max(0, min(self.viewport_x, img.width - new_width))
-            self.viewport_y = max(0, min(self.viewport_y, img.height - new_height))
+            self.viewport_x = max(0, min(self.viewport_x, view_width - new_width))
+            self.viewport_y = max(0, min(self.viewport_y, view_height - new_height))
             self.viewport_width = new_width
             self.viewport_height = new_height
 
+        if self.zoom_factor == 1.0:
+            if self.animation is None:
+                self.start_animation()
+        else:
+            self.stop_animation()  # 放大查看时显示静态的第一帧
         self.fast_redraw()
+        self.request_full_resolution()
+
+    def request_full_resolution(self):
+        """当前缩略解码的图片显示时超过 1:1（放大、窗口变大）时在后台重新解码
+
+        JPEG 按覆盖画布所需的最小 draft 缩放解码，只有需要时才加载原图。
+        """
+        if not self.image_paths:
+            return
+        current_path = self.image_paths[self.current_index]
+        meta = self.image_meta.get(current_path)
+        if not meta or meta['scale'] <= 1.0 or current_path in self.full_res_pending \
+                or current_path in self.full_res_rejected:
+            return
+        window_width = self.canvas.winfo_width()
+        window_height = self.canvas.winfo_height()
+        if window_width < 10 or window_height < 10:
+            return
+        density = min(window_width / self.viewport_width, window_height / self.viewport_height)
+        if density <= 1.0:
+            return
+        self.full_res_pending.add(current_path)
+        # 新的缩放倍数不能超过 当前倍数 / 屏幕像素密度；draft 会选择不小于目标尺寸的最小缩放
+        needed = meta['scale'] / density
+        full_width, full_height = meta['full_size']
+        target_size = (math.ceil(full_width / needed), math.ceil(full_height / needed)) if needed > 1.0 else None
+
+        def load_full():
+            try:
+                img, shm, full_meta = self.decode(current_path, target_size)
+                scale = full_meta['scale']
+            except Exception as e:
+                print(f"无法加载原图 {current_path}: {e}")
+                img, shm, scale = None, None, None
+            self.root.after(0, self.on_full_resolution_ready, current_path, img, shm, scale)
+
+        threading.Thread(target=load_full, daemon=True).start()
+
+    def on_full_resolution_ready(self, path, full_img, shm=None, scale=1.0):
+        self.full_res_pending.discard(path)
+        with self.cache_lock:
+            img_data = self.image_cache.get(path)
+            meta = self.image_meta.get(path)
+            if full_img is None or not img_data or not meta or scale >= meta['scale']:
+                self.discard_decoded(full_img, shm)
+                return
+            old_img, old_size = img_data
+            img_size = self.bitmap_size(full_img)
+            if img_size > self.cache_size_limit * 0.5:
+                self.full_res_rejected.add(path)
+                self.discard_decoded(full_img, shm)
+                return
+            self.image_cache[path] = (full_img, img_size)
+            self.current_cache_size += img_size - old_size
+            while self.current_cache_size > self.cache_size_limit and len(self.lru_list) > 1:
+                if next(iter(self.lru_list)) == path:
+                    self.lru_list.move_to_end(path)
+                self.remove_oldest_image()
+            meta['scale'] = scale
+            old_img.close()
+            self.release_shared_block(path)
+            self.release_pyramid(path)
+            if shm is not None:
+                self.shared_blocks[path] = shm
+
+        # 视口坐标换算到原图坐标系
+        if self.image_paths and self.image_paths[self.current_index] == path:
+            old_width, old_height = self.view_size(path, old_img)
+            new_width, new_height = self.view_size(path, full_img)
+            fx = new_width / old_width
+            fy = new_height / old_height
+            self.viewport_x *= fx
+            self.viewport_y *= fy
+            self.viewport_width *= fx
+            self.viewport_height *= fy
+            self.high_quality_redraw()
+
+    def select_pyramid_level(self, path, img, box, output_size):
+        """返回 (层级图片, 换算后的裁剪框)；金字塔尚未生成时使用原始缓存图片"""
+        source_per_output = min((box[2] - box[0]) / output_size[0], (box[3] - box[1]) / output_size[1])
+        if source_per_output < 2:
+            return img, box
+        levels = self.get_pyramid(path, img)
+        if not levels:
+            return img, box
+        source = img
+        for level in levels:
+            # 层级缩小倍数不能超过源像素与屏幕像素之比，否则会损失清晰度
+            if img.width / level.width > source_per_output:
+                break
+            source = level
+        sx = source.width / img.width
+        sy = source.height / img.height
+        return source, (box[0] * sx, box[1] * sy, min(source.width, box[2] * sx), min(source.height, box[3] * sy))
+
+    def get_pyramid(self, path, img):
+        with self.cache_lock:
+            entry = self.pyramids.get(path)
+            if entry and entry[0] is img:
+                return entry[1]
+            if entry:
+                # 缓存图片已被替换（变换或加载原图），旧金字塔作废
+                self.release_pyramid(path)
+            if path not in self.pyramid_pending:
+                self.pyramid_pending.add(path)
+                self.preload_executor.submit(self.build_pyramid, path, img)
+        return None
+
+    def build_pyramid(self, path, img):
+        try:
+            levels = []
+            level = img
+            while min(level.size) // 2 >= self.pyramid_min_side:
+                level = level.reduce(2)
+                levels.append(level)
+        except ValueError:
+            levels = []  # 图片已被淘汰关闭
+        finally:
+            with self.cache_lock:
+                self.pyramid_pending.discard(path)
+        if not levels:
+            return
+        nbytes = sum(self.bitmap_size(level) for level in levels)
+        with self.cache_lock:
+            img_data = self.image_cache.get(path)
+            if not img_data or img_data[0] is not img:
+                for level in levels:
+                    level.close()
+                return
+            # 与 load_image_to_cache 相同的淘汰检查，金字塔所属的图片本身不淘汰
+            while self.current_cache_size + nbytes > self.cache_size_limit and len(self.lru_list) > 1:
+                if next(iter(self.lru_list)) == path:
+                    self.lru_list.move_to_end(path)
+                self.remove_oldest_image()
+            if self.current_cache_size + nbytes > self.cache_size_limit:
+                # 放不下：记一个空金字塔，之后直接从缓存图片缩小，不再反复生成
+                for level in levels:
+                    level.close()
+                self.pyramids[path] = (img, [], 0)
+                return
+            self.pyramids[path] = (img, levels, nbytes)
+            self.current_cache_size += nbytes
+        self.root.after(0, self.on_pyramid_ready, path)
+
+    def on_pyramid_ready(self, path):
+        if self.image_paths and self.image_paths[self.current_index] == path:
+            self.high_quality_redraw()
+
+    def release_pyramid(self, path):
+        entry = self.pyramids.pop(path, None)
+        if entry:
+            for level in entry[1]:
+                level.close()
+            self.current_cache_size -= entry[2]
 
     def fast_redraw(self):
         if not self.image_paths:
@@ -443,7 +2215,7 @@ class ImageViewer:
         current_path = self.image_paths[self.current_index]
         img_data = self.image_cache.get(current_path)
         if img_data:
-            self.redraw_image(img_data[0], Image.Resampling.NEAREST)
+            self.redraw_image(img_data[0], Image.Resampling.NEAREST, current_path)
 
     def high_quality_redraw(self):
         if not self.image_paths:
@@ -451,7 +2223,7 @@ class ImageViewer:
         current_path = self.image_paths[self.current_index]
         img_data = self.image_cache.get(current_path)
         if img_data:
-            self.redraw_image(img_data[0], Image.Resampling.LANCZOS)
+            self.redraw_image(img_data[0], Image.Resampling.LANCZOS, current_path)
 
     def navigate(self, direction):
         max_index = len(self.image_paths) - 1
@@ -460,22 +2232,36 @@ class ImageViewer:
         else:
             self.current_index = min(max_index, self.current_index + 1)
         self.zoom_factor = 1.0  # 重置缩放因子
+        self.prefetch_planner.record(self.current_index)
         self.show_current_image()
 
     def start_playback(self):
         self.root.title("图片查看器 - 播放中...")
         self.disable_navigation()
+        self.stop_animation()
         self.canvas.unbind('<MouseWheel>')
         self.canvas.unbind('<ButtonPress-1>')
         self.canvas.unbind('<B1-Motion>')
         self.canvas.unbind('<ButtonRelease-1>')
-        self.auto_advance()
+        self.slideshow_start = time.monotonic()
+        self.slideshow_start_index = self.current_index
+        self.slideshow_due = self.slideshow_start + 1.0 / self.slideshow_fps
+        self.slideshow_shown = 0
+        self.slideshow_dropped = 0
+        # 显示帧环放大到整个预读深度
+        self.frame_ring_size = max(4, self.slideshow_depth() + 1)
+        self.schedule_slideshow_loads()
+        self.prerender_neighbors()
+        self.playback_id = self.root.after(int(1000 / self.slideshow_fps), self.auto_advance)
 
     def pause_playback(self):
         self.is_playing = False
         if self.playback_id:
             self.root.after_cancel(self.playback_id)
             self.playback_id = None
+        self.frame_ring_size = 4
+        while len(self.frame_ring) > self.frame_ring_size:
+            self.frame_ring.popitem(last=False)
         self.root.title(f"图片查看器 - {os.path.basename(self.image_paths[self.current_index])}")
         self.enable_navigation()
         self.canvas.bind('<MouseWheel>', self.on_mousewheel)
@@ -489,24 +2275,112 @@ class ImageViewer:
         self.show_current_image()
 
     def auto_advance(self):
-        if self.is_playing and self.current_index < len(self.image_paths) - 1:
-            self.navigate("next")
-            self.playback_id = self.root.after(1, self.auto_advance)
-        else:
+        """幻灯片节拍：只显示已在缓存中的图片，主线程上从不同步解码"""
+        self.playback_id = None
+        if not self.is_playing:
+            return
+        if self.current_index >= len(self.image_paths) - 1:
             self.stop_playback()
+            return
+        interval = 1.0 / self.slideshow_fps
+        now = time.monotonic()
+        if self.slideshow_policy == 'skip':
+            # 按时钟决定应显示哪一张，未就绪的图片计为丢帧
+            target = self.clock_index(now)
+            if target > self.current_index:
+                ready = next((idx for idx in range(target, self.current_index, -1)
+                              if self.image_paths[idx] in self.image_cache), None)
+                if ready is not None:
+                    self.slideshow_dropped += ready - self.current_index - 1
+                    self.show_slideshow_frame(ready)
+            next_due = self.slideshow_start + (target - self.slideshow_start_index + 1) * interval
+        else:
+            if now >= self.slideshow_due and self.image_paths[self.current_index + 1] in self.image_cache:
+                self.show_slideshow_frame(self.current_index + 1)
+                # 按截止时间累加避免漂移；等待超过一帧后从现在重新计时，不追赶
+                late = now - self.slideshow_due
+                self.slideshow_due = (self.slideshow_due if late < interval else now) + interval
+            next_due = self.slideshow_due
+        self.update_slideshow_title(now)
+        self.schedule_slideshow_loads()
+        self.prerender_neighbors()
+        # 未就绪时每 5ms 再检查一次，否则睡到下一个截止时间
+        delay = max(1, int((next_due - time.monotonic()) * 1000))
+        if self.slideshow_policy == 'hold' and now >= self.slideshow_due:
+            delay = 5
+        self.playback_id = self.root.after(delay, self.auto_advance)
+
+    def clock_index(self, now):
+        elapsed = now - self.slideshow_start
+        return min(len(self.image_paths) - 1, self.slideshow_start_index + int(elapsed * self.slideshow_fps))
+
+    def show_slideshow_frame(self, index):
+        self.current_index = index
+        current_path = self.image_paths[index]
+        img, _ = self.image_cache[current_path]
+        self.update_lru(current_path)
+        self.prefetch_planner.record(index)
+        self.zoom_factor = 1.0
+        self.viewport_x = 0
+        self.viewport_y = 0
+        self.viewport_width, self.viewport_height = self.view_size(current_path, img)
+        if self.show_prerendered_frame(current_path, img):
+            self.frame_ring.pop(current_path, None)  # 已显示的帧不再需要，腾出位置给后面的图片
+        else:
+            self.fast_redraw()
+        meta = self.image_meta.get(current_path)
+        if meta and meta.get('edge_color'):
+            self.canvas.config(bg='#%02x%02x%02x' % meta['edge_color'])
+        self.slideshow_shown += 1
+
+    def update_slideshow_title(self, now):
+        elapsed = now - self.slideshow_start
+        rate = self.slideshow_shown / elapsed if elapsed > 0 else 0.0
+        self.root.title(f"图片查看器 - 播放中 {rate:.1f}/{self.slideshow_fps:g} 张/秒，"
+                        f"丢帧 {self.slideshow_dropped} - {os.path.basename(self.image_paths[self.current_index])}")
+
+    def slideshow_depth(self):
+        """预读深度：目标帧率下 slideshow_lookahead 秒内要显示的张数，受缓存容量限制"""
+        return max(2, min(math.ceil(self.slideshow_fps * self.slideshow_lookahead), self.prefetch_budget()))
+
+    def slideshow_indices(self):
+        base = self.current_index
+        if self.slideshow_policy == 'skip':
+            base = max(base, self.clock_index(time.monotonic()))
+        return list(range(base + 1, min(len(self.image_paths), base + 1 + self.slideshow_depth())))
+
+    def schedule_slideshow_loads(self):
+        """只保留接下来要显示的图片的解码任务，落在时钟之后的任务会被取消"""
+        wanted = {}
+        for order, idx in enumerate(self.slideshow_indices()):
+            path = self.image_paths[idx]
+            if path not in self.image_cache:
+                wanted[path] = (LoadScheduler.NEIGHBOR if order == 0 else LoadScheduler.PREFETCH, order)
+        self.load_scheduler.replace(wanted)
+
+    def set_slideshow_fps(self):
+        self.slideshow_fps = self.slideshow_fps_var.get()
+        if self.is_playing:
+            # 从当前图片重新计时
+            self.slideshow_start = time.monotonic()
+            self.slideshow_due = self.slideshow_start + 1.0 / self.slideshow_fps
+            self.slideshow_start_index = self.current_index
+            self.slideshow_shown = 0
+            self.frame_ring_size = max(4, self.slideshow_depth() + 1)
+
+    def set_slideshow_policy(self):
+        self.slideshow_policy = self.slideshow_policy_var.get()
+        self.set_slideshow_fps()
 
     def load_initial_image(self, initial_image):
         directory = os.path.dirname(initial_image)
-        self.load_directory_images(directory)
-        try:
-            self.current_index = self.image_paths.index(initial_image)
-        except ValueError:
-            self.current_index = 0
-        self.show_current_image()
+        self.load_directory_images(directory, initial_image)
 
     def update_memory_limit(self):
         virtual_memory = psutil.virtual_memory()
         self.cache_size_limit = int(virtual_memory.available * 0.4)
+        self.file_cache_limit = int(virtual_memory.available * 0.1)
+        self.render_cache_limit = int(virtual_memory.available * 0.05)
 
     def toggle_playback(self, event=None):
         if not self.image_paths:
@@ -541,12 +2415,7 @@ class ImageViewer:
             self.show_current_image()
         else:
             self.last_directory = directory
-            self.load_directory_images(directory)
-            try:
-                self.current_index = self.image_paths.index(file_path)
-            except ValueError:
-                self.current_index = 0
-            self.show_current_image()
+            self.load_directory_images(directory, file_path)
 
     def on_drag_start(self, event):
         if not self.image_paths or self.is_playing:
@@ -564,9 +2433,9 @@ class ImageViewer:
         current_path = self.image_paths[self.current_index]
         img_data = self.image_cache.get(current_path)
         if img_data:
-            img, _ = img_data
-            self.viewport_x = max(0, min(self.viewport_x - img_dx, img.width - self.viewport_width))
-            self.viewport_y = max(0, min(self.viewport_y - img_dy, img.height - self.viewport_height))
+            view_width, view_height = self.view_size(current_path, img_data[0])
+            self.viewport_x = max(0, min(self.viewport_x - img_dx, view_width - self.viewport_width))
+            self.viewport_y = max(0, min(self.viewport_y - img_dy, view_height - self.viewport_height))
         self.fast_redraw()
         self.drag_start_x = event.x
         self.drag_start_y = event.y
@@ -582,30 +2451,295 @@ class ImageViewer:
         scale = min(window_width / self.viewport_width, window_height / self.viewport_height)
         return dx / scale, dy / scale
 
-    def load_directory_images(self, directory):
+    def load_directory_images(self, directory, initial_path=None):
+        """先显示请求的图片，再在后台流式扫描目录，逐步合并排序后的导航列表"""
         self.loading_active = False
+        self.load_scheduler.cancel_all()
         self.release_all_images()
-        self.image_paths = []
-        extensions = ['jpg', 'jpeg', 'png', 'bmp', 'gif', 'webp', 'tiff']
-        pattern = os.path.join(directory, '*')
-        for file_path in glob.glob(pattern, recursive=False):
-            ext = os.path.splitext(file_path)[1][1:].lower()
-            if ext in extensions:
-                self.image_paths.append(os.path.normpath(file_path))
-        self.image_paths.sort(key=self.natural_sort_key)
+        self.scan_generation += 1
+        if self.directory_watcher:
+            self.directory_watcher.stop()
+            self.directory_watcher = None
+        self.image_paths = [initial_path] if initial_path else []
+        self.current_index = 0
+        if initial_path:
+            self.show_current_image()
+        threading.Thread(target=self.scan_directory, args=(directory, initial_path, self.scan_generation),
+                         daemon=True).start()
+
+    def scan_directory(self, directory, initial_path, generation):
+        """后台线程：先查目录索引，目录有变化时再用 os.scandir 逐项读取，定期把已排序的快照交给主线程"""
+        directory = os.path.normpath(directory)
+        try:
+            dir_mtime = os.stat(directory).st_mtime_ns
+        except OSError as e:
+            print(f"无法读取目录 {directory}: {e}")
+            dir_mtime = None
+        cached = None
+        if self.directory_index:
+            try:
+                cached = self.directory_index.load(directory)
+            except sqlite3.Error as e:
+                # 索引被锁定或损坏时退回完整扫描
+                print(f"无法读取目录索引 {directory}: {e}")
+        if cached and cached[0] == dir_mtime:
+            paths = [os.path.join(directory, name) for name in cached[1]]
+            if initial_path and os.path.basename(initial_path) not in cached[1]:
+                paths.append(initial_path)
+                paths.sort(key=lambda p: self.natural_sort_key(os.path.basename(p)))
+            self.root.after(0, self.merge_scanned_paths, generation, paths, True)
+            return
+        old_entries = cached[1] if cached else {}
+        for position, entry in enumerate(old_entries.values()):
+            entry['position'] = position
+
+        seen = set()
+        scanned = []
+        indexed = {}
+        if initial_path:
+            seen.add(initial_path)
+            scanned.append((self.natural_sort_key(os.path.basename(initial_path)), initial_path))
+        last_post = time.monotonic()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if generation != self.scan_generation:
+                        return
+                    ext = os.path.splitext(entry.name)[1][1:].lower()
+                    if ext not in IMAGE_EXTENSIONS or not entry.is_file():
+                        continue
+                    path = os.path.normpath(entry.path)
+                    st = entry.stat()
+                    old = old_entries.get(entry.name)
+                    if old and (old['file_size'], old['mtime_ns']) == (st.st_size, st.st_mtime_ns):
+                        # 文件未变化，沿用已保存的排序键和图片信息
+                        key = json.loads(old['sort_key'])
+                        indexed[entry.name] = old
+                    else:
+                        key = self.natural_sort_key(entry.name)
+                        indexed[entry.name] = {'sort_key': json.dumps(key), 'file_size': st.st_size,
+                                               'mtime_ns': st.st_mtime_ns, 'width': None, 'height': None,
+                                               'format': None, 'edge_color': None, 'orientation': None}
+                    if path in seen:
+                        continue
+                    seen.add(path)
+                    scanned.append((key, path))
+                    if time.monotonic() - last_post > 0.25:
+                        scanned.sort()  # 已有部分有序，Timsort 只需合并新增部分
+                        self.root.after(0, self.merge_scanned_paths, generation, [p for _, p in scanned], False)
+                        last_post = time.monotonic()
+        except OSError as e:
+            print(f"无法读取目录 {directory}: {e}")
+            dir_mtime = None
+        scanned.sort()
+        self.root.after(0, self.merge_scanned_paths, generation, [p for _, p in scanned], True)
+        if self.directory_index and dir_mtime is not None:
+            ordered = OrderedDict((os.path.basename(p), indexed[os.path.basename(p)])
+                                  for _, p in scanned if os.path.basename(p) in indexed)
+            try:
+                self.directory_index.save(directory, dir_mtime, old_entries, ordered)
+            except sqlite3.Error as e:
+                print(f"无法保存目录索引 {directory}: {e}")
+
+    def merge_scanned_paths(self, generation, paths, done):
+        """替换导航列表，保持 current_index 指向同一个文件"""
+        if generation != self.scan_generation:
+            return
+        current_path = self.image_paths[self.current_index] if self.image_paths else None
+        self.image_paths = paths
+        if current_path is None:
+            self.current_index = 0
+            self.show_current_image()
+        else:
+            try:
+                self.current_index = paths.index(current_path)
+            except ValueError:
+                self.current_index = min(self.current_index, max(0, len(paths) - 1))
+        if not done:
+            self.enable_navigation()
+            return
+        self.start_directory_watcher(generation)
+        self.start_cache_warmup()
+
+    def start_directory_watcher(self, generation):
+        if not self.image_paths:
+            return
+        directory = os.path.dirname(self.image_paths[0])
+        self.directory_watcher = DirectoryWatcher(
+            directory, lambda events: self.root.after(0, self.apply_directory_changes, generation, events))
+        self.directory_watcher.start()
+
+    def directory_sort_key(self, path):
+        return self.natural_sort_key(os.path.basename(path))
+
+    def insert_image_path(self, path):
+        if path in self.image_paths:
+            return
+        key = self.directory_sort_key(path)
+        lo, hi = 0, len(self.image_paths)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.directory_sort_key(self.image_paths[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        self.image_paths.insert(lo, path)
+
+    def apply_directory_changes(self, generation, events):
+        """就地更新导航列表、LRU 和缓存，current_index 保持指向同一个文件"""
+        if generation != self.scan_generation:
+            return
+        current_path = self.image_paths[self.current_index] if self.image_paths else None
+        current_changed = False
+        for event in events:
+            kind, path = event[0], os.path.normpath(event[1]) if event[1] else None
+            if kind == 'moved':
+                new_path = os.path.normpath(event[2])
+                if path in self.image_paths:
+                    self.image_paths.remove(path)
+                    self.rename_cached_image(path, new_path)
+                    if path == current_path:
+                        current_path = new_path
+                self.insert_image_path(new_path)
+            elif kind == 'added':
+                self.insert_image_path(path)
+            elif kind == 'removed':
+                if path in self.image_paths:
+                    self.image_paths.remove(path)
+                self.evict_image(path)
+                current_changed |= path == current_path
+            elif kind == 'modified':
+                self.evict_image(path)
+                self.insert_image_path(path)
+                current_changed |= path == current_path
+        if not self.image_paths:
+            self.current_index = 0
+            self.canvas.delete("all")
+            self.canvas.image = None
+            return
+        if current_path in self.image_paths:
+            self.current_index = self.image_paths.index(current_path)
+        else:
+            self.current_index = min(self.current_index, len(self.image_paths) - 1)
+        if current_changed:
+            self.show_current_image()
+        else:
+            self.root.title(f"图片查看器 - {os.path.basename(self.image_paths[self.current_index])}")
+
+    def evict_image(self, path):
+        with self.cache_lock:
+            img_data = self.image_cache.pop(path, None)
+            if img_data:
+                img_data[0].close()
+                self.current_cache_size -= img_data[1]
+            self.lru_list.pop(path, None)
+            self.release_shared_block(path)
+            self.release_pyramid(path)
+            self.image_meta.pop(path, None)
+            self.full_res_rejected.discard(path)
+            self.release_file_bytes(path)
+            self.transforms.pop(path, None)
+
+    def rename_cached_image(self, old_path, new_path):
+        with self.cache_lock:
+            if old_path in self.image_cache:
+                self.image_cache[new_path] = self.image_cache.pop(old_path)
+            if old_path in self.lru_list:
+                self.lru_list[new_path] = self.lru_list.pop(old_path)
+            for table in (self.shared_blocks, self.pyramids, self.image_meta, self.file_cache, self.frame_ring,
+                          self.transforms):
+                if old_path in table:
+                    table[new_path] = table.pop(old_path)
+            if old_path in self.full_res_rejected:
+                self.full_res_rejected.discard(old_path)
+                self.full_res_rejected.add(new_path)
+
+    def start_cache_warmup(self):
+        """目录扫描完成后，在调度器空闲时从当前位置向外预热缓存"""
+        self.enable_navigation()
+        with self.warmup_lock:
+            self.warmup_attempted = set()
+            self.warmup_radius = 0
+            self.warmup_loaded = 0
+            self.warmup_bytes_only = False
+            self.loading_active = True
         if len(self.image_paths) > 30:
             self.show_loading_dialog()
-            self.loading_active = True
-            threading.Thread(target=self.async_load_images, daemon=True).start()
-        else:
-            self.sync_load_images()
+        self.load_scheduler.wake()
+
+    def next_warmup_path(self):
+        """由调度器线程调用：返回离当前图片最近且尚未尝试的图片，缓存将满时结束预热"""
+        with self.warmup_lock:
+            path, finished = self.pick_warmup_path()
+        # 跨线程的 root.after 要等主循环处理，必须在释放锁之后调用，否则与主线程的 start_cache_warmup 互相等待
+        if finished:
+            self.root.after(0, self.close_loading_dialog)
+        return path
+
+    def pick_warmup_path(self):
+        """持有 warmup_lock 时调用，返回 (路径, 是否刚结束预热)"""
+        if not self.loading_active or not self.image_paths:
+            return None, False
+        if self.current_cache_size >= self.cache_size_limit * 0.9 and not self.warmup_bytes_only:
+            # 位图缓存将满：从当前位置重新向外，只把文件字节读入第二级缓存
+            self.warmup_bytes_only = True
+            self.warmup_attempted = set(self.image_cache)
+            self.warmup_radius = 0
+        if self.warmup_bytes_only and self.file_cache_size >= self.file_cache_limit * 0.9:
+            self.loading_active = False
+            return None, True
+        paths = self.image_paths
+        index = self.current_index
+        if self.warmup_center != index:
+            self.warmup_center = index
+            self.warmup_radius = 0
+        while self.warmup_radius < len(paths):
+            r = self.warmup_radius
+            for idx in ((index + r, index - r) if r else (index,)):
+                if 0 <= idx < len(paths) and paths[idx] not in self.warmup_attempted:
+                    self.warmup_attempted.add(paths[idx])
+                    return paths[idx], False
+            self.warmup_radius += 1
+        self.loading_active = False
+        return None, True
+
+    def run_scheduled_load(self, path, priority):
+        if priority == LoadScheduler.WARMUP and self.warmup_bytes_only:
+            try:
+                self.file_source(path)
+            except OSError as e:
+                print(f"无法读取文件 {path}: {e}")
+            return
+        with self.perf.stage('load', path=os.path.basename(path), priority=priority):
+            loaded = self.load_image_to_cache(path, visible=priority == LoadScheduler.VISIBLE)
+        if not loaded:
+            return
+        if priority == LoadScheduler.VISIBLE:
+            self.root.after(0, self.on_current_loaded, path)
+        elif priority == LoadScheduler.NEIGHBOR or (priority == LoadScheduler.PREFETCH and self.is_playing):
+            self.root.after(0, self.prerender_neighbors)
+        elif priority == LoadScheduler.WARMUP:
+            with self.warmup_lock:
+                self.warmup_loaded += 1
+                loaded_count = self.warmup_loaded
+            self.root.after(0, self.update_progress, loaded_count, len(self.image_paths))
 
     def release_all_images(self):
-        for path in list(self.image_cache.keys()):
-            img, size = self.image_cache.pop(path)
-            img.close()
-        self.lru_list.clear()
-        self.current_cache_size = 0
+        with self.cache_lock:
+            for path in list(self.image_cache.keys()):
+                img, size = self.image_cache.pop(path)
+                img.close()
+                self.release_shared_block(path)
+                self.release_pyramid(path)
+            self.lru_list.clear()
+            self.image_meta.clear()
+            self.full_res_rejected.clear()
+            self.current_cache_size = 0
+            self.file_cache.clear()
+            self.file_cache_size = 0
+        self.frame_ring.clear()
+        self.render_cache.clear()
+        self.render_cache_size = 0
         self.canvas.delete("all")
         self.canvas.image = None
 
@@ -613,75 +2747,291 @@ class ImageViewer:
     def natural_sort_key(s):
         return [int(text) if text.isdigit() else text.lower() for text in re.split(r'(\d+)', s)]
 
-    def sync_load_images(self):
-        indices = {self.current_index, self.current_index - 1, self.current_index + 1}
-        for idx in indices:
-            if 0 <= idx < len(self.image_paths):
-                self.load_image_to_cache(self.image_paths[idx])
-        self.enable_navigation()
+    def decode(self, source, target_size=None, max_pixels=None, in_process=False):
+        """通过解码进程池解码，进程池不可用时退回进程内解码
 
-    def async_load_images(self):
-        total = len(self.image_paths)
-        loaded = 0
-        priority_indices = set(range(0, 3)) | set(range(len(self.image_paths) - 3, len(self.image_paths)))
-        for idx in priority_indices:
-            if 0 <= idx < len(self.image_paths) and self.loading_active:
-                self.load_image_to_cache(self.image_paths[idx])
-                loaded += 1
-                self.root.after(0, self.update_progress, loaded, total)
-        for idx, path in enumerate(self.image_paths):
-            if idx not in priority_indices and self.loading_active:
-                if self.load_image_to_cache(path):
-                    loaded += 1
-                    self.root.after(0, self.update_progress, loaded, total)
-        self.root.after(0, self.close_loading_dialog)
-        self.root.after(0, self.enable_navigation)
-
-    def load_image_to_cache(self, path):
-        if path in self.image_cache:
-            return True
+        当前显示的图片传 in_process=True：进程间传递和共享内存映射的开销比解码本身还大，直接在本进程解码。
+        """
+        if self.decode_service and not in_process:
+            try:
+                return self.decode_service.decode(source, target_size, max_pixels)
+            except concurrent.futures.process.BrokenProcessPool as e:
+                print(f"解码进程池已失效，改为进程内解码: {e}")
+                self.decode_service = None
+        img, meta = decode_image(source, target_size, max_pixels)
+        return img, None, meta
+
+    def file_source(self, path):
+        """返回文件字节（命中或读入字节缓存）；放不进字节缓存的大文件直接返回路径
+
+        只用于进程内解码，交给解码进程池的任务只传路径。
+        """
+        with self.cache_lock:
+            data = self.file_cache.get(path)
+            if data is not None:
+                self.file_cache.move_to_end(path)
+                return data
+        if os.path.getsize(path) > self.file_cache_limit * 0.5:
+            return path
+        with open(path, 'rb') as f:
+            data = f.read()
+        with self.cache_lock:
+            if path not in self.file_cache:
+                while self.file_cache_size + len(data) > self.file_cache_limit and self.file_cache:
+                    old_path, old = self.file_cache.popitem(last=False)
+                    self.file_cache_size -= len(old)
+                    self.perf.mark('evict.file', path=os.path.basename(old_path), bytes=len(old))
+                self.file_cache[path] = data
+                self.file_cache_size += len(data)
+        return data
+
+    def release_file_bytes(self, path):
+        with self.cache_lock:
+            data = self.file_cache.pop(path, None)
+            if data is not None:
+                self.file_cache_size -= len(data)
+
+    def load_tiled_image(self, path, full_size):
+        """超大图片改用分块后端；分块等到显示时才切（见 build_tile_store），缓存按已加载的分块记账"""
+        budget = int(min(256 * 1024 * 1024, self.cache_size_limit * 0.25))
+        tiled = TiledImage(path, full_size, self.tile_store_root, self.tile_size, budget)
         try:
-            with Image.open(path) as img:
-                img = img.convert('RGB')
-                width, height = img.size
-                channels = 3
-                bytes_per_pixel = 1
-                img_size = width * height * channels * bytes_per_pixel
+            with Image.open(path) as header:
+                orientation = header.getexif().get(EXIF_ORIENTATION, 1)
+        except OSError:
+            orientation = 1
+        with self.cache_lock:
+            self.image_meta[path] = {'full_size': full_size, 'scale': 1.0, 'format': None, 'orientation': orientation}
+            self.apply_orientation(path, self.image_meta[path])
+            self.image_cache[path] = (tiled, 0)
+            self.lru_list[path] = True
+            self.lru_list.move_to_end(path)
+        return True
+
+    def build_tile_store(self, path, tiled):
+        """显示或缩放需要分块时在后台切块，同一目录只切一次"""
+        if tiled.ready or tiled.store_dir in self.tile_store_pending:
+            return
+        self.tile_store_pending.add(tiled.store_dir)
+        if self.decode_service:
+            future = self.decode_service.executor.submit(prepare_tile_store, path, tiled.store_dir, self.tile_size)
+        else:
+            future = self.preload_executor.submit(prepare_tile_store, path, tiled.store_dir, self.tile_size)
+        future.add_done_callback(lambda f: self.root.after(0, self.on_tiles_ready, path, tiled, f))
+
+    def account_tiles(self, path, tiled):
+        """把分块实际占用的内存计入缓存，超出上限时淘汰其它图片"""
+        with self.cache_lock:
+            img_data = self.image_cache.get(path)
+            if not img_data or img_data[0] is not tiled or img_data[1] == tiled.tile_bytes:
+                return
+            self.current_cache_size += tiled.tile_bytes - img_data[1]
+            self.image_cache[path] = (tiled, tiled.tile_bytes)
+            while self.current_cache_size > self.cache_size_limit and len(self.lru_list) > 1:
+                if next(iter(self.lru_list)) == path:
+                    self.lru_list.move_to_end(path)
+                self.remove_oldest_image()
+
+    def on_tiles_ready(self, path, tiled, future):
+        self.tile_store_pending.discard(tiled.store_dir)
+        if future.exception():
+            print(f"无法生成分块 {path}: {future.exception()}")
+            return
+        tiled.reload()
+        overview = tiled.overview()
+        self.account_tiles(path, tiled)
+        with self.cache_lock:
+            keep = {img.store_dir for img, _ in self.image_cache.values() if isinstance(img, TiledImage)}
+        keep |= self.tile_store_pending
+        self.preload_executor.submit(trim_tile_stores, self.tile_store_root, self.tile_store_limit, keep)
+        if self.thumbnail_store and overview is not None:
+            self.preload_executor.submit(self.store_thumbnail, path, overview, tiled.size,
+                                         self.image_meta.get(path, {}).get('orientation'))
+        if self.image_paths and self.image_paths[self.current_index] == path and \
+                self.image_cache.get(path, (None,))[0] is tiled:
+            self.show_current_image()
+
+    @staticmethod
+    def bitmap_size(img):
+        return img.width * img.height * len(img.getbands())
+
+    @staticmethod
+    def discard_decoded(img, shm):
+        if img is not None:
+            img.close()
+        if shm is not None:
+            DecodeService.release(shm)
+
+    def release_shared_block(self, path):
+        shm = self.shared_blocks.pop(path, None)
+        if shm is not None:
+            DecodeService.release(shm)
+
+    def load_image_to_cache(self, path, visible=False):
+        """解码图片放入缓存；visible 表示正在等待显示的图片，在本进程内解码，其余交给解码进程池"""
+        with self.cache_lock:
+            if path in self.image_cache:
+                return True
+            # 同一张图片只解码一次，其它线程等待结果
+            event = self.inflight_loads.get(path)
+            owner = event is None
+            if owner:
+                event = self.inflight_loads[path] = threading.Event()
+        if not owner:
+            event.wait()
+            return path in self.image_cache
+        try:
+            target_size = self.decode_target_size if self.display_resolution_decode else None
+            max_pixels = min(self.tiled_pixel_threshold, int(self.cache_size_limit * 0.25 / 4))
+            try:
+                if visible or not self.decode_service:
+                    with self.perf.stage('load.read'):
+                        source = self.file_source(path)
+                else:
+                    # 交给解码进程时只传路径，由子进程自己读盘；缓存的文件字节经管道 pickle 的开销与读盘相当
+                    source = path
+                start = time.perf_counter()
+                img, shm, meta = self.decode(source, target_size, max_pixels, in_process=visible)
+            except ImageTooLarge as e:
+                return self.load_tiled_image(path, e.full_size)
+            end = time.perf_counter()
+            elapsed = end - start
+            timings = meta.pop('timings', {})
+            self.perf.span('load.decode', start, end, path=os.path.basename(path),
+                           **{stage: round(seconds * 1000, 2) for stage, seconds in timings.items()})
+            for stage, seconds in timings.items():
+                self.perf.record(f'decode.{stage}', seconds)
+            if shm is not None:
+                # 进程池排队、参数传递和共享内存映射的开销
+                self.perf.record('decode.ipc', max(0.0, elapsed - sum(timings.values())))
+            img_size = self.bitmap_size(img)
+            with self.cache_lock:
                 if img_size > self.cache_size_limit * 0.5:
+                    self.discard_decoded(img, shm)
                     return False
                 while self.current_cache_size + img_size > self.cache_size_limit and self.lru_list:
                     self.remove_oldest_image()
                 if self.current_cache_size + img_size > self.cache_size_limit:
+                    self.discard_decoded(img, shm)
                     return False
-                self.image_cache[path] = (img.copy(), img_size)
+                self.image_meta[path] = meta
+                self.apply_orientation(path, meta)
+                self.image_cache[path] = (img, img_size)
+                if shm is not None:
+                    self.shared_blocks[path] = shm
                 self.lru_list[path] = True
                 self.lru_list.move_to_end(path)
                 self.current_cache_size += img_size
-                return True
+            if self.thumbnail_store and not self.thumbnail_store.contains(path):
+                self.preload_executor.submit(self.store_thumbnail, path, img, meta['full_size'], meta['orientation'])
+            if self.directory_index:
+                self.preload_executor.submit(self.record_image_info, path, meta)
+            return True
         except Exception as e:
             print(f"无法加载图片 {path}: {e}")
             return False
+        finally:
+            with self.cache_lock:
+                self.inflight_loads.pop(path, None)
+            event.set()
+
+    def record_image_info(self, path, meta):
+        try:
+            self.directory_index.record_image(path, meta)
+        except sqlite3.Error as e:
+            print(f"无法更新目录索引 {path}: {e}")
+
+    def apply_orientation(self, path, meta):
+        """首次加载时把 EXIF 方向并入图片的显示变换，之后的旋转翻转在此基础上叠加"""
+        orientation = ORIENTATION_TRANSFORMS.get(meta.get('orientation'))
+        if orientation and path not in self.transforms:
+            self.transforms[path] = orientation
+
+    def store_thumbnail(self, path, img, full_size, orientation=None):
+        try:
+            return self.thumbnail_store.put(path, img, full_size, ORIENTATION_TRANSFORMS.get(orientation))
+        except (OSError, ValueError, sqlite3.Error) as e:
+            # 图片可能已被淘汰关闭，下次加载时再生成
+            print(f"无法保存缩略图 {path}: {e}")
+            return None
+
+    def cached_thumbnail(self, path):
+        """只读查询缩略图缓存，可在主线程调用；访问时间交给后台线程批量写入"""
+        if not self.thumbnail_store:
+            return None
+        try:
+            cached = self.thumbnail_store.get(path)
+        except (OSError, sqlite3.Error) as e:
+            print(f"无法读取缩略图缓存 {path}: {e}")
+            return None
+        if cached:
+            self.preload_executor.submit(self.flush_thumbnail_access)
+        return cached
+
+    def flush_thumbnail_access(self):
+        try:
+            self.thumbnail_store.flush()
+        except sqlite3.Error as e:
+            print(f"无法更新缩略图缓存: {e}")
+
+    def get_thumbnail(self, path):
+        """读取缩略图缓存，未命中时以缩略尺寸解码并写入缓存"""
+        if not self.thumbnail_store:
+            return None
+        cached = self.cached_thumbnail(path)
+        if cached:
+            return cached[0]
+        try:
+            img, shm, meta = self.decode(path, self.thumbnail_store.thumb_size, self.tiled_pixel_threshold)
+        except Exception as e:
+            print(f"无法生成缩略图 {path}: {e}")
+            return None
+        try:
+            return self.store_thumbnail(path, img, meta['full_size'], meta['orientation'])
+        finally:
+            self.discard_decoded(img, shm)
 
     def remove_oldest_image(self):
-        if self.lru_list:
-            oldest_path = next(iter(self.lru_list))
-            if oldest_path in self.image_cache:
-                img, size = self.image_cache.pop(oldest_path)
-                img.close()
-                del self.lru_list[oldest_path]
-                self.current_cache_size -= size
+        with self.cache_lock:
+            if self.lru_list:
+                oldest_path = next(iter(self.lru_list))
+                if oldest_path in self.image_cache:
+                    img, size = self.image_cache.pop(oldest_path)
+                    self.perf.mark('evict.bitmap', path=os.path.basename(oldest_path), bytes=size)
+                    img.close()
+                    self.release_shared_block(oldest_path)
+                    self.release_pyramid(oldest_path)
+                    del self.lru_list[oldest_path]
+                    self.current_cache_size -= size
 
     def show_current_image(self):
+        self.stop_animation()
         if not self.image_paths or self.current_index >= len(self.image_paths):
             return
+        with self.perf.stage('show', index=self.current_index):
+            self.present_current_image()
+        self.perf.sample('cache', bitmap=self.current_cache_size, files=self.file_cache_size,
+                         render=self.render_cache_size)
+
+    def present_current_image(self):
         current_path = self.image_paths[self.current_index]
-        preload_indices = {self.current_index - 1, self.current_index + 1}
-        for idx in preload_indices:
-            if 0 <= idx < len(self.image_paths):
-                threading.Thread(target=self.load_image_to_cache, args=(self.image_paths[idx],), daemon=True).start()
-        if current_path not in self.image_cache:
-            self.load_image_to_cache(current_path)
         self.root.title(f"图片查看器 - {os.path.basename(current_path)}")
+        self.perf.count('bitmap', current_path in self.image_cache)
+        if current_path not in self.image_cache:
+            cached = self.cached_thumbnail(current_path)
+            if cached:
+                # 先画缓存的缩略图，原图由调度器以最高优先级在后台解码
+                self.show_placeholder(cached[0])
+                edge_hex = self.directory_index.edge_color(current_path) if self.directory_index else None
+                if edge_hex:
+                    self.animate_background(tuple(int(edge_hex[i:i + 2], 16) for i in (1, 3, 5)))
+                self.schedule_loads(current_path)
+                return
+            self.schedule_loads()
+            with self.perf.stage('show.load'):
+                self.load_image_to_cache(current_path, visible=True)
+        else:
+            self.schedule_loads()
         self.update_lru(current_path)
         img_data = self.image_cache.get(current_path)
         if not img_data:
@@ -690,16 +3040,135 @@ class ImageViewer:
         self.zoom_factor = 1.0  # 重置缩放因子
         self.viewport_x = 0
         self.viewport_y = 0
-        self.viewport_width = img.width
-        self.viewport_height = img.height
+        self.viewport_width, self.viewport_height = self.view_size(current_path, img)
 
-        # 调整窗口大小
-        self.adjust_window_size(img)
+        # 调整窗口大小（按变换后的原图尺寸）
+        meta = self.image_meta.get(current_path)
+        self.adjust_window_size(self.get_transform(current_path).output_size(meta['full_size'] if meta else img.size))
 
-        self.fast_redraw()
-        self.analyze_edge_colors()
+        with self.perf.stage('show.present'):
+            prerendered = self.show_prerendered_frame(current_path, img)
+            self.perf.count('frame_ring', prerendered)
+            if not prerendered:
+                self.fast_redraw()
+        with self.perf.stage('show.edge'):
+            self.analyze_edge_colors()
+        self.prerender_neighbors()
+        self.start_animation()
+        # 按旧窗口尺寸解码的图片（窗口变大后预取的相邻图片）不够覆盖画布时重新解码
+        self.request_full_resolution()
+
+    def show_placeholder(self, thumb):
+        self.zoom_factor = 1.0
+        self.viewport_x = 0
+        self.viewport_y = 0
+        self.viewport_width = thumb.width
+        self.viewport_height = thumb.height
+        self.redraw_image(thumb, Image.Resampling.BILINEAR)
 
-    def adjust_window_size(self, img):
+    def on_current_loaded(self, path):
+        if self.image_paths and self.image_paths[self.current_index] == path:
+            self.show_current_image()
+
+    def show_thumbnail_overview(self):
+        """缩略图总览：只加载可见行的缩略图，点击跳转到对应图片"""
+        if not self.image_paths:
+            return
+        cell = 170
+        thumb_side = 160
+        paths = list(self.image_paths)
+        window = tk.Toplevel(self.root)
+        window.title(f"缩略图总览 - {len(paths)} 张")
+        window.geometry("900x600")
+        scrollbar = tk.Scrollbar(window, orient=tk.VERTICAL)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        grid = tk.Canvas(window, bg='#222222', yscrollcommand=scrollbar.set, yscrollincrement=cell // 2)
+        grid.pack(fill=tk.BOTH, expand=True)
+        photos = {}
+        pending = set()
+
+        def columns():
+            return max(1, grid.winfo_width() // cell)
+
+        def layout(event=None):
+            rows = (len(paths) + columns() - 1) // columns()
+            grid.config(scrollregion=(0, 0, columns() * cell, rows * cell))
+            grid.delete("all")
+            photos.clear()
+            refresh()
+
+        def draw(idx, thumb):
+            if not window.winfo_exists() or thumb is None:
+                return
+            thumb = thumb.copy()
+            thumb.thumbnail((thumb_side, thumb_side))
+            photos[idx] = ImageTk.PhotoImage(thumb)
+            row, col = divmod(idx, columns())
+            grid.create_image(col * cell + cell // 2, row * cell + cell // 2, image=photos[idx], tags=(f"i{idx}",))
+
+        def refresh():
+            # 只为可见区域加载缩略图，并释放滚出视野的图片
+            top = grid.canvasy(0)
+            bottom = top + grid.winfo_height()
+            first = max(0, int(top // cell)) * columns()
+            last = min(len(paths), (int(bottom // cell) + 1) * columns())
+            for idx in list(photos):
+                if not first <= idx < last:
+                    grid.delete(f"i{idx}")
+                    del photos[idx]
+            for idx in range(first, last):
+                if idx in photos or idx in pending:
+                    continue
+                pending.add(idx)
+                self.preload_executor.submit(load, idx)
+
+        def load(idx):
+            thumb = self.get_thumbnail(paths[idx])
+            pending.discard(idx)
+            self.root.after(0, draw, idx, thumb)
+
+        def on_scroll(*args):
+            grid.yview(*args)
+            refresh()
+
+        def on_wheel(event):
+            grid.yview_scroll(-1 if event.delta > 0 else 1, "units")
+            refresh()
+
+        def on_click(event):
+            idx = int(grid.canvasy(event.y) // cell) * columns() + int(event.x // cell)
+            if idx < len(paths) and paths[idx] in self.image_paths and not self.is_playing:
+                self.current_index = self.image_paths.index(paths[idx])
+                self.show_current_image()
+
+        scrollbar.config(command=on_scroll)
+        grid.bind('<Configure>', layout)
+        grid.bind('<MouseWheel>', on_wheel)
+        grid.bind('<Button-1>', on_click)
+
+    def prefetch_budget(self):
+        """预读最多占用一半缓存，按已缓存图片的平均大小折算成张数"""
+        with self.cache_lock:
+            sizes = [size for _, size in self.image_cache.values()]
+        if not sizes:
+            return 3
+        return max(3, int(self.cache_size_limit * 0.5 / (sum(sizes) / len(sizes))))
+
+    def schedule_loads(self, visible_path=None):
+        """按当前位置重新排定后台加载：不在新计划中的排队任务会被取消"""
+        indices = self.prefetch_planner.plan(self.current_index, len(self.image_paths), self.prefetch_budget())
+        wanted = {}
+        if visible_path:
+            wanted[visible_path] = (LoadScheduler.VISIBLE, 0)
+        for order, idx in enumerate(indices):
+            path = self.image_paths[idx]
+            if path in self.image_cache or path in wanted:
+                continue
+            priority = LoadScheduler.NEIGHBOR if abs(idx - self.current_index) == 1 else LoadScheduler.PREFETCH
+            wanted[path] = (priority, order)
+        self.load_scheduler.replace(wanted)
+
+    def adjust_window_size(self, img_size):
         # 获取屏幕分辨率
         screen_width = self.root.winfo_screenwidth()
         screen_height = self.root.winfo_screenheight()
@@ -708,7 +3177,7 @@ class ImageViewer:
         min_size = 300  # 最小宽高阈值（像素）
         max_size_factor = 0.9  # 最大尺寸占屏幕的百分比
 
-        img_width, img_height = img.size
+        img_width, img_height = img_size
 
         # 检查是否过小
         if img_width < min_size or img_height < min_size:
@@ -749,6 +3218,7 @@ class ImageViewer:
 
                 # 更新窗口大小
                 geometry = f"{new_width}x{new_height}"
+                self.requested_window_size = (new_width, new_height)
                 self.root.geometry(geometry)
 
                 # 计划下一帧
@@ -756,6 +3226,7 @@ class ImageViewer:
             else:
                 # 确保最终大小精确匹配目标
                 final_geometry = f"{target_width}x{target_height}"
+                self.requested_window_size = (target_width, target_height)
                 self.root.geometry(final_geometry)
                 print(f"调整窗口大小为: {final_geometry}")
 
@@ -769,10 +3240,25 @@ class ImageViewer:
     def on_resize(self, event):
         if self.resize_timer:
             self.root.after_cancel(self.resize_timer)
+        window_width = self.canvas.winfo_width()
+        window_height = self.canvas.winfo_height()
+        if window_width >= 10 and window_height >= 10:
+            self.decode_target_size = (window_width, window_height)
+            if any(entry[2] != (window_width, window_height) for entry in self.frame_ring.values()):
+                self.frame_ring.clear()
         # 立即进行快速重绘
+        if self.animation and self.animation.display_size != (window_width, window_height):
+            self.stop_animation()
         self.fast_redraw()
-        # 延迟高质量重绘
-        self.resize_timer = self.root.after(200, self.high_quality_redraw)
+        # 延迟高质量重绘，窗口变大后可能需要原图
+        self.resize_timer = self.root.after(200, self.on_resize_settled)
+
+    def on_resize_settled(self):
+        self.high_quality_redraw()
+        self.request_full_resolution()
+        if self.animation is None:
+            self.start_animation()
+        self.prerender_neighbors()
 
     def show_loading_dialog(self):
         self.loading_dialog = tk.Toplevel(self.root)
@@ -781,20 +3267,21 @@ class ImageViewer:
         self.progress.pack(padx=20, pady=10)
         self.loading_label = tk.Label(self.loading_dialog, text="正在加载图片，请稍候...")
         self.loading_label.pack(pady=5)
+        # 预热在后台按优先级进行，不再模态锁定主窗口
         self.loading_dialog.transient(self.root)
-        self.loading_dialog.grab_set()
 
     def update_progress(self, loaded, total):
-        if self.loading_dialog.winfo_exists():
+        if self.loading_dialog is not None and self.loading_dialog.winfo_exists():
             self.progress['value'] = (loaded / total) * 100
             self.loading_label.config(
                 text=f"已加载 {loaded}/{total} 张图片 内存：({self.format_memory(self.current_cache_size)} / {self.format_memory(self.cache_size_limit)})"
+                     f" 文件缓存：({self.format_memory(self.file_cache_size)} / {self.format_memory(self.file_cache_limit)})"
             )
 
     def close_loading_dialog(self):
-        if self.loading_dialog.winfo_exists():
-            self.loading_dialog.grab_release()
+        if self.loading_dialog is not None and self.loading_dialog.winfo_exists():
             self.loading_dialog.destroy()
+        self.loading_dialog = None
 
     def enable_navigation(self):
         if not self.is_playing:
@@ -839,6 +3326,215 @@ class ImageViewer:
     def on_right_release(self, event):
         self.stop_repeat()
 
+    def on_close(self):
+        self.loading_active = False
+        if self.hud_id:
+            self.root.after_cancel(self.hud_id)
+        self.stop_animation()
+        self.load_scheduler.shutdown()
+        if self.directory_watcher:
+            self.directory_watcher.stop()
+        self.preload_executor.shutdown(wait=False, cancel_futures=True)
+        self.frame_executor.shutdown(wait=False, cancel_futures=True)
+        if self.decode_service:
+            self.decode_service.shutdown()
+        if self.thumbnail_store:
+            self.thumbnail_store.close()
+        if self.directory_index:
+            self.directory_index.close()
+        self.release_all_images()
+        self.root.destroy()
+
+    # 跟踪时记录的输入事件；绑定在插到 bindtags 最前面的 'trace' 标签上，不受其它绑定的 "break" 影响
+    TRACE_INPUT_EVENTS = ('<KeyPress>', '<KeyRelease>', '<ButtonPress>', '<ButtonRelease>', '<MouseWheel>')
+
+    def toggle_trace(self):
+        if self.trace_var.get():
+            self.start_trace()
+        else:
+            self.stop_trace()
+
+    def start_trace(self):
+        """开始新的跟踪记录：root.after 换成记录回调耗时和延迟的包装，输入事件记为瞬时事件"""
+        self.trace_recorder = TraceRecorder()
+        self.perf.trace = self.trace_recorder
+        self.root.after = self.traced_after
+        for sequence in self.TRACE_INPUT_EVENTS:
+            self.root.bind_class('trace', sequence, self.trace_input)
+        for widget in (self.root, self.canvas):
+            widget.bindtags(('trace',) + widget.bindtags())
+
+    def stop_trace(self):
+        """停止记录，保留已记录的事件供导出"""
+        self.perf.trace = None
+        self.root.__dict__.pop('after', None)
+        for widget in (self.root, self.canvas):
+            widget.bindtags(tuple(tag for tag in widget.bindtags() if tag != 'trace'))
+
+    def traced_after(self, ms, func=None, *args):
+        if func is None:
+            return tk.Misc.after(self.root, ms)
+        name = getattr(func, '__qualname__', None) or repr(func)
+        due = time.perf_counter() + ms / 1000
+
+        def callback(*callback_args):
+            start = time.perf_counter()
+            try:
+                return func(*callback_args)
+            finally:
+                trace = self.perf.trace
+                if trace is not None:
+                    trace.complete(name, 'after', start, time.perf_counter(),
+                                   {'delay_ms': ms, 'late_ms': round((start - due) * 1000, 2)})
+
+        return tk.Misc.after(self.root, ms, callback, *args)
+
+    def trace_input(self, event):
+        kind = event_kind(event)
+        if kind in ('KeyPress', 'KeyRelease'):
+            self.perf.mark(f'input.{kind}', key=event.keysym)
+        else:
+            self.perf.mark(f'input.{kind}', button=event.num, delta=event.delta, x=event.x, y=event.y)
+
+    def export_trace(self):
+        if self.trace_recorder is None:
+            messagebox.showinfo("提示", "尚未记录性能跟踪，请先在文件菜单中开启“记录性能跟踪”")
+            return
+        file_path = filedialog.asksaveasfilename(initialfile="trace.json", defaultextension=".json",
+                                                 filetypes=[("Chrome 跟踪文件", "*.json"), ("所有文件", "*.*")])
+        if not file_path:
+            return
+        recorder = self.trace_recorder
+
+        def write():
+            try:
+                recorder.export(file_path)
+                error = None
+            except OSError as e:
+                error = e
+            self.root.after(0, self.on_trace_exported, file_path, error)
+
+        threading.Thread(target=write, daemon=True).start()
+
+    def on_trace_exported(self, file_path, error):
+        if error:
+            print(f"无法导出性能跟踪 {file_path}: {error}")
+            messagebox.showerror("错误", f"无法导出性能跟踪：{error}")
+        else:
+            messagebox.showinfo("提示", f"已导出到 {file_path}，可在 ui.perfetto.dev 中打开")
+
+    def toggle_input_recording(self):
+        if self.record_var.get():
+            self.start_input_recording()
+        else:
+            self.stop_input_recording()
+
+    def start_input_recording(self):
+        """从当前图片和窗口尺寸开始录制，之前未保存的录制被丢弃"""
+        if not self.image_paths:
+            self.record_var.set(False)
+            messagebox.showinfo("提示", "请先打开图片再开始录制")
+            return
+        current_path = self.image_paths[self.current_index]
+        self.root.update_idletasks()
+        settings = {'slideshow_fps': self.slideshow_fps, 'slideshow_policy': self.slideshow_policy}
+        self.input_recorder = InputRecorder(os.path.dirname(current_path), os.path.basename(current_path),
+                                            (self.root.winfo_width(), self.root.winfo_height()), settings)
+        for sequence in InputRecorder.EVENTS:
+            self.root.bind_class('record', sequence, self.record_input)
+        for widget in (self.root, self.canvas):
+            widget.bindtags(('record',) + widget.bindtags())
+
+    def stop_input_recording(self):
+        for widget in (self.root, self.canvas):
+            widget.bindtags(tuple(tag for tag in widget.bindtags() if tag != 'record'))
+
+    def record_input(self, event):
+        kind = event_kind(event)
+        if kind == 'Configure':
+            # 只记录用户调整主窗口尺寸，画布随之变化，窗口尺寸动画重放时会自行发生
+            if event.widget is not self.root or (event.width, event.height) == self.requested_window_size:
+                return
+        # 按键在重放时发给主窗口，由焦点所在窗口的绑定处理
+        widget = 'canvas' if event.widget is self.canvas and 'Key' not in kind else 'root'
+        self.input_recorder.record(event, widget)
+
+    def save_input_recording(self):
+        if self.input_recorder is None:
+            messagebox.showinfo("提示", "尚未录制输入，请先在文件菜单中开启“录制输入”")
+            return
+        file_path = filedialog.asksaveasfilename(initialfile="recording.json", defaultextension=".json",
+                                                 filetypes=[("输入录制", "*.json"), ("所有文件", "*.*")])
+        if not file_path:
+            return
+        try:
+            self.input_recorder.save(file_path)
+        except OSError as e:
+            print(f"无法保存输入录制 {file_path}: {e}")
+            messagebox.showerror("错误", f"无法保存输入录制：{e}")
+            return
+        messagebox.showinfo("提示", f"已保存 {len(self.input_recorder.events)} 个事件到 {file_path}，"
+                                   f"可用 replay.py 重放")
+
+    # 浮层中显示的阶段（名称, 标签），缩进的行是上一行的组成部分
+    HUD_STAGES = (('show', '切换'), ('show.load', '  同步加载'), ('show.present', '  上屏'), ('show.edge', '  边缘色'),
+                  ('redraw', '重绘'), ('redraw.render', '  裁剪缩放'), ('redraw.photo', '  PhotoImage'),
+                  ('redraw.canvas', '  画布'),
+                  ('load.read', '读取文件'), ('load.decode', '解码总计'), ('decode.decode', '  解码'),
+                  ('decode.convert', '  转换 RGB'), ('decode.edge', '  边缘采样'), ('decode.ipc', '  进程通信'),
+                  ('prerender', '预渲染'))
+
+    def toggle_hud(self, event=None):
+        if event is not None:
+            self.hud_var.set(not self.hud_var.get())
+        if self.hud_var.get():
+            if self.hud is None:
+                self.hud = tk.Label(self.root, justify=tk.LEFT, anchor='nw', font='TkFixedFont',
+                                    bg='#000000', fg='#7CFC00', padx=6, pady=4)
+            self.hud.place(in_=self.canvas, x=8, y=8)
+            self.hud.lift()
+            self.update_hud()
+        else:
+            if self.hud_id:
+                self.root.after_cancel(self.hud_id)
+                self.hud_id = None
+            if self.hud is not None:
+                self.hud.place_forget()
+
+    def update_hud(self):
+        """每 500 毫秒刷新浮层：各阶段 p50/p90/最大值、切换耗时分布、缓存命中率和内存占用"""
+        lines = [f"{self.pad_label('阶段', 14)}{'p50':>7}{'p90':>7}{'max':>7}  ms"]
+        for name, label in self.HUD_STAGES:
+            stats = self.perf.percentiles(name)
+            if stats:
+                lines.append(f"{self.pad_label(label, 14)}{stats[50]:7.1f}{stats[90]:7.1f}{stats['max']:7.1f}")
+        counts = self.perf.histogram('show')
+        if any(counts):
+            peak = max(counts)
+            bars = ''.join(' ▁▂▃▄▅▆▇█'[math.ceil(count / peak * 8)] for count in counts)
+            lines.append(f"切换分布 ≤{'/'.join(map(str, PerfStats.BUCKETS))}+: {bars}")
+        rates = []
+        for name, label in (('bitmap', '位图'), ('frame_ring', '预渲染帧'), ('render', '渲染')):
+            rate = self.perf.hit_rate(name)
+            if rate is not None:
+                rates.append(f"{label} {rate:.0%}")
+        if rates:
+            lines.append("命中率 " + "  ".join(rates))
+        lines.append(f"进程内存 {self.format_memory(self.process.memory_info().rss)}")
+        lines.append(f"位图缓存 {self.format_memory(self.current_cache_size)}/{self.format_memory(self.cache_size_limit)}"
+                     f"  {len(self.image_cache)} 张")
+        lines.append(f"文件缓存 {self.format_memory(self.file_cache_size)}"
+                     f"  渲染缓存 {self.format_memory(self.render_cache_size)}")
+        self.hud.config(text="\n".join(lines))
+        self.hud.lift()
+        self.hud_id = self.root.after(500, self.update_hud)
+
+    @staticmethod
+    def pad_label(text, width):
+        """按等宽字体中的显示宽度补齐，中文字符占两列"""
+        columns = sum(2 if unicodedata.east_asian_width(c) in 'WF' else 1 for c in text)
+        return text + ' ' * max(0, width - columns)
+
     @staticmethod
     def format_memory(size):
         for unit in ['B', 'KB', 'MB', 'GB']:
@@ -849,6 +3545,7 @@ class ImageViewer:
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     root = tk.Tk()
     root.geometry("1024x768")
     initial_image = None